@@ -1,2 +1,41 @@
-from .perspectivefields import PerspectiveFields
+import importlib
 
+from .model_zoo import model_zoo
+
+# helpers of .utils resolved on first access by __getattr__
+_UTILS = (
+    "PanoCam",
+    "VisualizerPerspective",
+    "decode_bin",
+    "decode_bin_latitude",
+    "draw_from_r_p_f",
+    "draw_from_r_p_f_cx_cy",
+    "draw_horizon_line",
+    "draw_latitude_field",
+    "draw_perspective_fields",
+    "draw_prediction_distribution",
+    "draw_up_field",
+    "encode_bin",
+    "encode_bin_latitude",
+    "general_vfov",
+    "general_vfov_to_focal",
+    "pf_postprocess",
+)
+
+__all__ = ["PerspectiveFields", "model_zoo", *_UTILS]
+
+
+def __getattr__(name):
+    # PerspectiveFields and the helpers re-exported from .utils depend on torch,
+    # so they are imported on first access; this keeps torch-free modules such
+    # as perspective2d.onnx_runtime importable without it. Any other name
+    # (submodules not imported yet, introspection probes such as __wrapped__)
+    # must not import them.
+    if name == "PerspectiveFields":
+        from .perspectivefields import PerspectiveFields
+
+        return PerspectiveFields
+    if name in _UTILS:
+        utils = importlib.import_module(".utils", __name__)
+        return getattr(utils, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,349 @@
+"""
+Micro-benchmarks of the inference hot paths.
+
+Each stage of `PerspectiveFields.inference_batch` is timed separately on
+synthetic frames with randomly initialized weights (nothing is downloaded):
+preprocessing, the backbone and each of its stages, the low-level encoder, each
+decode head, the full-resolution postprocessing (`pf_postprocess`) of each
+head, ParamNet and the visualization of one prediction, plus the whole
+`inference_batch` call.
+Frames and weights are seeded, so runs of different commits on the same host
+are comparable:
+
+    python -m perspective2d.bench --batch-sizes 1 4 --resolutions 224 320 --output new.json
+    python -m perspective2d.bench --batch-sizes 1 4 --resolutions 224 320 --compare old.json
+    python -m perspective2d.bench --attn-impls math sdpa chunked
+
+Per stage the report holds the p50 / p99 / mean latency in milliseconds, the
+throughput in images per second and the peak memory in MB: allocated memory on
+CUDA, and the peak resident set size of the process on CPU (Linux only).
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from .model_zoo import model_zoo
+from .perspectivefields import PerspectiveFields
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _reset_peak_memory(device):
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        return
+    try:
+        # resets VmHWM to the current resident set size
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_memory_mb(device):
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return None
+
+
+def time_stage(fn, device, batch_size, repeat=10, warmup=2):
+    """
+    Time `fn()` `repeat` times after `warmup` untimed calls.
+
+    Returns:
+        dict: "p50_ms", "p99_ms", "mean_ms", "throughput" (images/s for
+            `batch_size` images per call) and "peak_memory_mb".
+    """
+    for _ in range(warmup):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    _reset_peak_memory(device)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return {
+        "p50_ms": float(np.percentile(times, 50)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "mean_ms": float(times.mean()),
+        "throughput": batch_size / times.mean() * 1000,
+        "peak_memory_mb": _peak_memory_mb(device),
+    }
+
+
+def synthetic_frames(batch_size, height=480, width=640, seed=0):
+    """
+    Smooth random BGR uint8 frames (upsampled noise, so the content is not
+    pure high-frequency noise).
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(batch_size):
+        small = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+        frames.append(cv2.resize(small, (width, height), cv2.INTER_CUBIC))
+    return frames
+
+
+def random_model(version, device="cpu", seed=0, **kwargs):
+    """
+    `PerspectiveFields` with seeded random weights.
+    """
+    torch.manual_seed(seed)
+    return PerspectiveFields(version, weights=False, **kwargs).eval().to(device)
+
+
+@torch.no_grad()
+def benchmark(
+    model,
+    batch_size=1,
+    resolution=None,
+    image_size=(480, 640),
+    precision=None,
+    repeat=10,
+    warmup=2,
+    visualize=True,
+):
+    """
+    Time each inference stage of `model` on a synthetic batch.
+
+    Args:
+        model (PerspectiveFields): the model to benchmark.
+        batch_size (int): images per batch.
+        resolution (int): internal resolution, see `inference_batch`.
+        image_size (tuple): (height, width) of the synthetic frames.
+        precision (str): see `inference_batch`.
+        repeat (int): timed calls per stage.
+        warmup (int): untimed calls per stage.
+        visualize (bool): also time `draw_perspective_fields` on one image.
+
+    Returns:
+        dict: stage name -> results of :func:`time_stage`. A stage that fails
+            (e.g. a plotting backend issue) maps to {"error": message}.
+    """
+    device = model.device
+    frames = synthetic_frames(batch_size, *image_size)
+    precision = precision or model.precision
+    heads = model.persformer_heads
+    stats = {}
+
+    def run(name, fn):
+        try:
+            stats[name] = time_stage(fn, device, batch_size, repeat, warmup)
+        except Exception as e:
+            stats[name] = {"error": f"{type(e).__name__}: {e}"}
+
+    run("preprocess", lambda: model.preprocess_batch(frames, resolution))
+    images, batched_inputs = model.preprocess_batch(frames, resolution)
+    images = images.contiguous(memory_format=model.memory_format)
+    with model._autocast(precision):
+        run("backbone", lambda: model.backbone(images))
+        if hasattr(model.backbone, "forward_stage"):
+            x = images
+            for stage in range(1, 5):
+                run(
+                    f"backbone_stage{stage}",
+                    lambda: model.backbone.forward_stage(x, stage),
+                )
+                x = model.backbone.forward_stage(x, stage)
+        run("ll_enc", lambda: model.ll_enc(images))
+        features = {"hl": model.backbone(images), "ll": model.ll_enc(images)}
+        results = {}
+        if heads.gravity_on:
+            run("gravity_head", lambda: heads.gravity_head.inference(features))
+            results["pred_gravity"] = heads.gravity_head.inference(features)
+        if heads.latitude_on:
+            run("latitude_head", lambda: heads.latitude_head.inference(features))
+            results["pred_latitude"] = heads.latitude_head.inference(features)
+    results = {k: v.float() for k, v in results.items()}
+
+    processed = [{} for _ in batched_inputs]
+    for key, head in (("gravity", "gravity_head"), ("latitude", "latitude_head")):
+        if f"pred_{key}" not in results:
+            continue
+        head = getattr(heads, head)
+        args = (results[f"pred_{key}"], batched_inputs, images)
+        run(f"{key}_postprocess", lambda: head.postprocess(*args))
+        for p, out in zip(processed, head.postprocess(*args)):
+            p.update(out)
+
+    if model.param_net is not None:
+        run(
+            "param_net",
+            lambda: model._camera_params(results, None, images, batched_inputs),
+        )
+    if visualize and "pred_gravity_original" in processed[0]:
+        from .utils import draw_perspective_fields
+
+        img_rgb = frames[0][..., ::-1]
+        up = processed[0]["pred_gravity_original"].cpu()
+        latitude = torch.deg2rad(processed[0]["pred_latitude_original"].cpu())
+        run(
+            "visualization",
+            lambda: draw_perspective_fields(img_rgb, up, latitude),
+        )
+    run(
+        "end_to_end",
+        lambda: model.inference_batch(
+            frames, precision=precision, internal_resolution=resolution
+        ),
+    )
+    return stats
+
+
+def environment():
+    """
+    Host and library versions recorded with every report.
+    """
+    return {
+        "commit": _git_commit(),
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+    }
+
+
+def compare(baseline, report):
+    """
+    Per-configuration and stage p50 speedups of `report` over `baseline`.
+
+    Returns:
+        list: (configuration key, stage, baseline p50, p50, speedup) tuples.
+    """
+    base = {_config_key(run): run["stages"] for run in baseline["runs"]}
+    rows = []
+    for run in report["runs"]:
+        key = _config_key(run)
+        if key not in base:
+            continue
+        for stage, result in run["stages"].items():
+            old = base[key].get(stage, {})
+            if "p50_ms" not in result or "p50_ms" not in old:
+                continue
+            speedup = old["p50_ms"] / result["p50_ms"]
+            rows.append((key, stage, old["p50_ms"], result["p50_ms"], speedup))
+    return rows
+
+
+def _config_key(run):
+    return (
+        f"{run['version']} {run['device']} bs={run['batch_size']} "
+        f"res={run['resolution']} {run['precision']} {run.get('attn_impl', 'math')}"
+        + (" optimize" if run.get("optimize") else "")
+        + (" channels_last" if run.get("channels_last") else "")
+    )
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Per-stage inference micro-benchmarks with random weights"
+    )
+    parser.add_argument(
+        "--versions", nargs="+", default=None, help="default: all of model_zoo"
+    )
+    parser.add_argument("--devices", nargs="+", default=["cpu"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[320])
+    parser.add_argument("--image-size", type=int, nargs=2, default=[480, 640])
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument(
+        "--attn-impls", nargs="+", default=["math"], help="math, sdpa or chunked"
+    )
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--no-visualize", action="store_true")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    parser.add_argument("--compare", default=None, help="baseline JSON report")
+    return parser
+
+
+def main(args=None):
+    args = get_parser().parse_args(args)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    report = {"environment": environment(), "runs": []}
+    for version in args.versions or list(model_zoo):
+        for device, attn_impl in itertools.product(args.devices, args.attn_impls):
+            model = random_model(
+                version,
+                device,
+                attn_impl=attn_impl,
+                optimize=args.optimize,
+                channels_last=args.channels_last,
+            )
+            for batch_size in args.batch_sizes:
+                for resolution in args.resolutions:
+                    stages = benchmark(
+                        model,
+                        batch_size,
+                        resolution,
+                        tuple(args.image_size),
+                        args.precision,
+                        args.repeat,
+                        args.warmup,
+                        visualize=not args.no_visualize,
+                    )
+                    run = {
+                        "version": version,
+                        "device": device,
+                        "batch_size": batch_size,
+                        "resolution": resolution,
+                        "image_size": args.image_size,
+                        "precision": args.precision,
+                        "attn_impl": attn_impl,
+                        "optimize": args.optimize,
+                        "channels_last": args.channels_last,
+                        "stages": stages,
+                    }
+                    report["runs"].append(run)
+                    print(json.dumps(run))
+            del model
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key, stage, old, new, speedup in compare(baseline, report):
+            print(f"{key} {stage}: {old:.2f} ms -> {new:.2f} ms ({speedup:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Result cache for repeated calibration queries.
+
+Predictions are keyed by a hash of the image content and of everything that
+changes the output for it: model version and weights, output mode, precision,
+quantization, resize mode, backbone settings and internal resolution.
+Entries are kept in a size-bounded in-memory LRU and, optionally, as compressed
+.npz files in a size-bounded directory, with fields stored in fp16 and camera
+parameters as fp32 scalars:
+
+    from perspective2d.cache import ResultCache
+    pf_model = PerspectiveFields(version, cache=ResultCache(cache_dir="~/.cache/perspective2d/results"))
+
+Cache hits return the stored fp16 fields converted back to fp32 tensors.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def image_hash(img):
+    """
+    Hash of the pixels and shape of an HxWx3 image.
+    """
+    if torch.is_tensor(img):
+        img = img.cpu().numpy()
+    img = np.ascontiguousarray(img)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{img.shape}{img.dtype}".encode())
+    digest.update(img.data)
+    return digest.hexdigest()
+
+
+def to_compact(prediction):
+    """
+    NumPy copy of a prediction dict with fields in fp16; parameters (tensors of
+    at most one dimension) keep fp32.
+    """
+    compact = {}
+    for key, value in prediction.items():
+        if torch.is_tensor(value):
+            value = value.detach().cpu()
+            if value.is_floating_point():
+                dtype = torch.float16 if value.dim() >= 2 else torch.float32
+                value = value.to(dtype)
+            compact[key] = value.numpy()
+        else:
+            compact[key] = np.asarray(value)
+    return compact
+
+
+def from_compact(compact, device="cpu"):
+    """
+    Inverse of :func:`to_compact`, with floating point tensors in fp32.
+    """
+    prediction = {}
+    for key, value in compact.items():
+        if value.dtype.kind == "U":
+            prediction[key] = str(value)
+            continue
+        tensor = torch.from_numpy(np.array(value))
+        if tensor.is_floating_point():
+            tensor = tensor.float()
+        prediction[key] = tensor.to(device)
+    return prediction
+
+
+def _nbytes(compact):
+    return sum(v.nbytes for v in compact.values())
+
+
+class ResultCache:
+    """
+    In-memory LRU of predictions with an optional on-disk second level.
+
+    Args:
+        max_memory_bytes (int): bound on the size of the in-memory entries.
+        cache_dir (str): directory of the on-disk entries, or None to keep
+            results in memory only.
+        max_disk_bytes (int): bound on the size of `cache_dir`; least recently
+            used files are removed first. Files written by other processes are
+            only accounted for when the cache is created.
+    """
+
+    def __init__(
+        self, max_memory_bytes=256 << 20, cache_dir=None, max_disk_bytes=4 << 30
+    ):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self.hits = self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._fingerprints = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        if self.cache_dir is not None:
+            self._scan()
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".npz"):
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def __getstate__(self):
+        # e.g. sent to InferencePool workers: each gets its own memory level and
+        # shares the directory
+        state = self.__dict__.copy()
+        del state["_lock"], state["_fingerprints"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._fingerprints = weakref.WeakKeyDictionary()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def key(self, model, img_bgr, output_mode="full", precision=None, **kwargs):
+        """
+        Cache key of the prediction of `model` for `img_bgr`.
+
+        Args:
+            model (PerspectiveFields): the model.
+            img_bgr (np.ndarray): HxWx3 BGR uint8 image.
+            output_mode, precision, **kwargs: the arguments of
+                `PerspectiveFields.inference_batch`.
+        """
+        if model not in self._fingerprints:
+            from .export import weights_fingerprint
+
+            self._fingerprints[model] = weights_fingerprint(model)
+        settings = {
+            "version": model.version,
+            "weights": self._fingerprints[model],
+            "output_mode": output_mode,
+            "precision": precision or model.precision,
+            "quantize": model.quantize,
+            "resize_mode": model.resize_mode,
+            "attn_impl": model.attn_impl,
+            "optimized": model.optimized,
+            "channels_last": model.memory_format == torch.channels_last,
+            "block3": [
+                model.backbone.block3_depth,
+                model.backbone.block3_mode,
+                model.backbone.block3_exit_tol,
+                model.backbone.block3_min_depth,
+            ],
+            **kwargs,
+        }
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+        digest.update(image_hash(img_bgr).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        The compact prediction stored under `key`, or None.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            on_disk = key in self._disk
+        if not on_disk:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                compact = {k: data[k] for k in data.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            # removed by another process, or a partial file
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._remember(key, compact)
+        return compact
+
+    def put(self, key, prediction):
+        """
+        Store a prediction dict (of tensors) under `key`.
+        """
+        compact = to_compact(prediction)
+        if self.cache_dir is not None:
+            self._write(key, compact)
+        with self._lock:
+            self._remember(key, compact)
+
+    def _remember(self, key, compact):
+        if key in self._memory:
+            self._memory_bytes -= _nbytes(self._memory.pop(key))
+        self._memory[key] = compact
+        self._memory_bytes += _nbytes(compact)
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= _nbytes(evicted)
+
+    def _write(self, key, compact):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **compact)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        evict = []
+        with self._lock:
+            self._disk_bytes += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                evict.append(old_key)
+        for old_key in evict:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def inference_batch(self, model, img_bgr_list, run, **kwargs):
+        """
+        Predictions for `img_bgr_list`, calling `run` only for images (and
+        duplicates within the batch only once) that are not cached.
+
+        Args:
+            model (PerspectiveFields): the model `run` belongs to.
+            img_bgr_list (list): HxWx3 BGR uint8 images.
+            run (callable): uncached `inference_batch(img_bgr_list, **kwargs)`.
+            **kwargs: arguments of `PerspectiveFields.inference_batch`.
+        """
+        keys = [self.key(model, img, **kwargs) for img in img_bgr_list]
+        results = [None] * len(keys)
+        missing = {}
+        hits = 0
+        for i, key in enumerate(keys):
+            compact = None if key in missing else self.get(key)
+            if compact is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                results[i] = from_compact(compact, model.device)
+                hits += 1
+        with self._lock:
+            # duplicates of a missing image are computed once, not served
+            self.misses += len(missing)
+            self.hits += hits
+        if missing:
+            first = [idx[0] for idx in missing.values()]
+            predictions = run([img_bgr_list[i] for i in first], **kwargs)
+            for (key, idx), prediction in zip(missing.items(), predictions):
+                self.put(key, prediction)
+                results[idx[0]] = prediction
+                for i in idx[1:]:
+                    results[i] = dict(prediction)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def clear(self):
+        """
+        Drop all entries, including the files in `cache_dir`.
+        """
+        with self._lock:
+            keys = list(self._disk)
+            self._memory.clear()
+            self._disk.clear()
+            self._memory_bytes = self._disk_bytes = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+def general_vfov(d_cx, d_cy, h, focal, degree):
+    """
+    Calculate the general vertical field of view (gvfov) given the camera intrinsic parameters.
+
+    The general vertical field of view (gvfov) is a concept employed to define the field of view (FoV) for images that may be cropped or have an off-center principal point.
+
+    The gfov is defined as follows:
+        Consider the camera's pinhole as 'O'. Let 'M1' and 'M2' represent the midpoints of the top and bottom edges of the image, respectively.
+        The gfov is defined as the angle subtended by the lines OM1 and OM2 at 'O'.
+
+    This function can handle parameters given in two ways:
+    1. Relative to the image height: In this case, h should be 1, and d_cx, d_cy, and focal should be normalized by the image height.
+    2. Absolute pixel values: In this case, h should be the image height in pixels, and d_cx, d_cy, and focal should be provided in pixels.
+
+    Args:
+        d_cx (float): Horizontal offset of the principal point (cx) from the image center.
+        d_cy (float): Vertical offset of the principal point (cy) from the image center.
+        h (float): Image height, either relative (1) or in absolute pixel values.
+        focal (float): Focal length of the camera, either relative to the image height or in absolute pixel values.
+        degree (bool): Indicator for the FoV return unit. If True, FoV is returned in degrees. If False, it's returned in radians.
+
+    Returns:
+        float: General vertical field of view (FoV), computed based on the provided parameters and returned in either degrees or radians, depending on the 'degree' parameter.
+    """
+    p_sqr = focal**2 + d_cx**2 + (d_cy + 0.5 * h) ** 2
+    q_sqr = focal**2 + d_cx**2 + (d_cy - 0.5 * h) ** 2
+    cos_FoV = (p_sqr + q_sqr - h**2) / 2 / np.sqrt(p_sqr) / np.sqrt(q_sqr)
+    FoV_rad = np.arccos(cos_FoV)
+    if degree:
+        return np.degrees(FoV_rad)
+    else:
+        return FoV_rad
+
+
+def general_vfov_to_focal(rel_cx, rel_cy, h, gvfov, degree):
+    """
+    Converts a given general vertical field of view (gvfov) to the equivalent focal length.
+
+    The general vertical field of view (gvfov) is a concept employed to define the field of view (FoV) for images that may be cropped or have an off-center principal point.
+
+    The gfov is defined as follows:
+        Consider the camera's pinhole as 'O'. Let 'M1' and 'M2' represent the midpoints of the top and bottom edges of the image, respectively.
+        The gfov is defined as the angle subtended by the lines OM1 and OM2 at 'O'.
+
+    This function accepts parameters in either relative terms or absolute pixel values:
+    1. Relative to the image height: In this case, h should be 1, and d_cx, d_cy should be normalized by the image height.
+    2. Absolute pixel values: In this case, h should be the image height in pixels, and d_cx, d_cy should be provided in pixels.
+
+    Args:
+        rel_cx (float): Horizontal offset of the principal point (cx) from the image center.
+                        It's in absolute terms if h is set to image height, else it's relative (cx coordinate / image width - 0.5).
+        rel_cy (float): Vertical offset of the principal point (cy) from the image center.
+                        It's in absolute terms if h is set to image height, else it's relative (cy coordinate / image height - 0.5).
+        h (float): Image height, either in relative terms (set as 1) or as absolute pixel values.
+        gvfov (float): General vertical field of view. It's in degrees if degree is set to True, else it's in radians.
+        degree (bool): Indicator for the gvfov unit. If True, gvfov is assumed to be in degrees. If False, it's in radians.
+
+    Returns:
+        float: Focal length, derived from the input gvfov and the principal point offsets (rel_cx, rel_cy).
+               It is relative to the image height if h is set to 1, else it's an absolute value (in pixels).
+    """
+    # scipy is slow to import and only needed by models regressing general_vfov
+    import scipy.optimize
+
+    def fun(focal, *args):
+        h, d_cx, d_cy, target_cos_FoV = args
+
+        p_sqr = (focal / h) ** 2 + d_cx**2 + (d_cy + 0.5) ** 2
+        q_sqr = (focal / h) ** 2 + d_cx**2 + (d_cy - 0.5) ** 2
+        cos_FoV = (p_sqr + q_sqr - 1) / 2 / np.sqrt(p_sqr) / np.sqrt(q_sqr)
+        return cos_FoV - target_cos_FoV
+
+    if degree:
+        gvfov = np.radians(gvfov)
+    if type(rel_cx) != np.ndarray:
+        # if input is float
+        focal = scipy.optimize.fsolve(
+            fun, 1.5, args=(h, rel_cx, rel_cy, np.cos(gvfov))
+        )[0]
+    else:
+        # if input is numpy array
+        focal = scipy.optimize.fsolve(
+            fun, np.ones(len(rel_cx)) * 1.5, args=(h, rel_cx, rel_cy, np.cos(gvfov))
+        )
+    focal = np.abs(focal)
+    return focal
@@ -0,0 +1,349 @@
+"""
+Multi-model ensembles with shared backbone features.
+
+Several `model_zoo` versions (or fine-tuned variants of one) often keep the
+backbone or the low-level encoder of the model they were trained from. The
+:class:`Ensemble` hashes the weights of these modules and runs each distinct
+one once per image; models with identical weights, preprocessing and backbone
+settings reuse its `hl` (backbone) and `ll` (low-level encoder) features and
+only run their own decode heads and ParamNet:
+
+    ensemble = Ensemble(["Paramnet-360Cities-edina-centered", "PersNet-360Cities"])
+    predictions = ensemble.inference_batch(images)  # version -> list of dicts
+    print(ensemble.groups(), ensemble.stats())
+
+Features are also kept per image in a small LRU keyed by the image hash, so
+querying the models of an ensemble one after another on the same images runs
+each shared module only once as well. `python -m perspective2d.ensemble
+<images>` prints the sharing groups and the time against running the models
+separately.
+"""
+
+import argparse
+import hashlib
+import time
+from collections import OrderedDict
+
+import torch
+
+from .cache import image_hash
+
+
+def module_hash(module):
+    """
+    Hash of the names, shapes, dtypes and exact values of the parameters and
+    buffers of `module`.
+    """
+    digest = hashlib.sha1()
+    with torch.no_grad():
+        for name, tensor in module.state_dict().items():
+            if not torch.is_tensor(tensor):
+                # e.g. packed quantized weights
+                digest.update(f"{name}{id(module)}".encode())
+                continue
+            tensor = tensor.detach().cpu().contiguous()
+            digest.update(f"{name}{tuple(tensor.shape)}{tensor.dtype}".encode())
+            digest.update(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _preprocess_key(model):
+    return (
+        model.resize_mode,
+        model.input_format,
+        (model.aug.new_h, model.aug.new_w),
+        tuple(model.pixel_mean.flatten().tolist()),
+        tuple(model.pixel_std.flatten().tolist()),
+        str(model.device),
+    )
+
+
+class Ensemble:
+    """
+    Args:
+        models (list | dict): `PerspectiveFields` models or `model_zoo`
+            versions, or a dict of name -> model. Models are named after their
+            version otherwise.
+        max_cached_images (int): number of images whose features are kept
+            between calls; 0 only shares features within a call. Features of
+            letterboxed batches (`resize_mode="pad"`) and of the adaptive
+            block 3 early exit depend on the other images of the batch and are
+            not kept.
+        **kwargs: passed to `PerspectiveFields` for versions given by name.
+    """
+
+    def __init__(self, models, max_cached_images=32, **kwargs):
+        from .perspectivefields import PerspectiveFields
+
+        if isinstance(models, dict):
+            items = list(models.items())
+        else:
+            items = []
+            for model in models:
+                if isinstance(model, str):
+                    model = PerspectiveFields(model, **kwargs).eval()
+                items.append((model.version, model))
+        names = [name for name, _ in items]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate model names: {names}; pass a dict")
+        self.models = OrderedDict(items)
+        self.max_cached_images = max_cached_images
+        self._features = OrderedDict()
+        self._hl_keys = {}
+        self._ll_keys = {}
+        hashes = {}
+        for name, model in self.models.items():
+            for module in (model.backbone, model.ll_enc):
+                if module not in hashes:
+                    hashes[module] = module_hash(module)
+            backbone = model.backbone
+            # everything besides the weights that changes the features
+            settings = (
+                _preprocess_key(model),
+                model.quantize,
+                model.attn_impl,
+                model.optimized,
+                str(model.memory_format),
+            )
+            self._hl_keys[name] = (
+                "hl",
+                hashes[backbone],
+                settings,
+                backbone.block3_depth,
+                backbone.block3_mode,
+                backbone.block3_exit_tol,
+                backbone.block3_min_depth,
+            )
+            self._ll_keys[name] = ("ll", hashes[model.ll_enc], settings)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.runs = {"hl": 0, "ll": 0}
+        self.shared = {"hl": 0, "ll": 0}
+        self.cache_hits = 0
+
+    def clear(self):
+        """
+        Drop the features kept between calls.
+        """
+        self._features.clear()
+
+    def groups(self):
+        """
+        Returns:
+            dict: "hl" and "ll", each a list of lists of the names of the models
+                sharing the features.
+        """
+        groups = {}
+        for kind, keys in (("hl", self._hl_keys), ("ll", self._ll_keys)):
+            members = OrderedDict()
+            for name, key in keys.items():
+                members.setdefault(key, []).append(name)
+            groups[kind] = list(members.values())
+        return groups
+
+    def stats(self):
+        """
+        Returns:
+            dict: batched forwards of the backbone ("hl") and of the low-level
+                encoder ("ll"), the per-model forwards saved by sharing, and the
+                number of images whose features came from the LRU.
+        """
+        return {
+            "backbone_runs": self.runs["hl"],
+            "backbone_runs_saved": self.shared["hl"],
+            "ll_enc_runs": self.runs["ll"],
+            "ll_enc_runs_saved": self.shared["ll"],
+            "cache_hits": self.cache_hits,
+            "cached_images": len(self._features),
+        }
+
+    def _run_module(self, kind, model, images, precision):
+        self.runs[kind] += 1
+        images = images.contiguous(memory_format=model.memory_format)
+        with model._autocast(precision):
+            if kind == "hl":
+                return model.backbone(images)
+            return model.ll_enc(images)
+
+    def _shared_features(self, kind, model, key, images, hashes, precision, memo):
+        """
+        Features of `images` for one model: from `memo` if a model of the same
+        group ran in this call, else from the LRU and the module.
+        """
+        key = key + (precision, tuple(images.shape[-2:]))
+        if key in memo:
+            self.shared[kind] += 1
+            return memo[key]
+        if hashes is None:
+            memo[key] = features = self._run_module(kind, model, images, precision)
+            return features
+
+        entries = [self._features.get((key, h)) for h in hashes]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        self.cache_hits += len(entries) - len(missing)
+        for i, entry in enumerate(entries):
+            if entry is not None:
+                self._features.move_to_end((key, hashes[i]))
+        if len(missing) == len(entries):
+            features = self._run_module(kind, model, images, precision)
+        else:
+            if missing:
+                computed = self._run_module(kind, model, images[missing], precision)
+                for j, i in enumerate(missing):
+                    entries[i] = _index(computed, j)
+            features = _stack(entries)
+        for i in missing:
+            self._features[(key, hashes[i])] = _index(features, i)
+            while len(self._features) > self.max_cached_images:
+                self._features.popitem(last=False)
+        memo[key] = features
+        return features
+
+    @torch.no_grad()
+    def inference_batch(
+        self,
+        img_bgr_list,
+        output_mode="full",
+        precision=None,
+        internal_resolution=None,
+        models=None,
+    ):
+        """
+        Predictions of every model of the ensemble.
+
+        Args:
+            img_bgr_list (list): HxWx3 BGR uint8 images.
+            output_mode, precision, internal_resolution: see
+                `PerspectiveFields.inference_batch`.
+            models (list): names of the models to run, default all.
+
+        Returns:
+            dict: model name -> list of per-image prediction dicts.
+        """
+        hashes = None
+        if self.max_cached_images > 0:
+            hashes = [image_hash(img) for img in img_bgr_list]
+        inputs = {}
+        memo = {}
+        outputs = OrderedDict()
+        for name in models or self.models:
+            model = self.models[name]
+            model_precision = precision or model.precision
+            prep_key = _preprocess_key(model)
+            if prep_key not in inputs:
+                inputs[prep_key] = model.preprocess_batch(
+                    img_bgr_list, internal_resolution=internal_resolution
+                )
+            images, batched_inputs = inputs[prep_key]
+            cacheable = (
+                hashes is not None
+                and "image_size" not in batched_inputs[0]
+                and model.backbone.block3_exit_tol is None
+            )
+            features = {}
+            for kind, keys in (("hl", self._hl_keys), ("ll", self._ll_keys)):
+                features[kind] = self._shared_features(
+                    kind,
+                    model,
+                    keys[name],
+                    images,
+                    hashes if cacheable else None,
+                    model_precision,
+                    memo,
+                )
+            outputs[name] = model._forward_images(
+                images,
+                batched_inputs,
+                output_mode=output_mode,
+                precision=precision,
+                hl_features=features["hl"],
+                ll_features=features["ll"],
+            )
+        return outputs
+
+    def inference(self, img_bgr, **kwargs):
+        """
+        Predictions of every model for one image, see :meth:`inference_batch`.
+
+        Returns:
+            dict: model name -> prediction dict.
+        """
+        outputs = self.inference_batch([img_bgr], **kwargs)
+        return {name: predictions[0] for name, predictions in outputs.items()}
+
+
+def _index(features, i):
+    if isinstance(features, (list, tuple)):
+        return [f[i] for f in features]
+    return features[i]
+
+
+def _stack(entries):
+    if isinstance(entries[0], list):
+        return [torch.stack(level) for level in zip(*entries)]
+    return torch.stack(entries)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Run several models with shared backbone features"
+    )
+    parser.add_argument("source", help="image directory, image or video")
+    parser.add_argument(
+        "--versions", nargs="+", default=None, help="default: all of model_zoo"
+    )
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--output-mode", default="params")
+    parser.add_argument("--internal-resolution", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=4)
+    return parser
+
+
+def main(args=None):
+    from .model_zoo import model_zoo
+    from .perspectivefields import PerspectiveFields
+    from .streaming import iter_source, load_frame
+
+    args = get_parser().parse_args(args)
+    models = {
+        version: PerspectiveFields(version).eval().to(args.device)
+        for version in args.versions or list(model_zoo)
+    }
+    ensemble = Ensemble(models, max_cached_images=0)
+    print(f"shared backbones: {ensemble.groups()['hl']}")
+    print(f"shared low-level encoders: {ensemble.groups()['ll']}")
+    items = list(iter_source(args.source))
+    kwargs = {
+        "output_mode": args.output_mode,
+        "internal_resolution": args.internal_resolution,
+    }
+    separate = shared = 0.0
+    for start in range(0, len(items), args.batch_size):
+        keys = [key for key, _ in items[start : start + args.batch_size]]
+        frames = [
+            load_frame(item) for _, item in items[start : start + args.batch_size]
+        ]
+        begin = time.perf_counter()
+        for model in models.values():
+            model.inference_batch(frames, **kwargs)
+        separate += time.perf_counter() - begin
+        begin = time.perf_counter()
+        outputs = ensemble.inference_batch(frames, **kwargs)
+        shared += time.perf_counter() - begin
+        for name, predictions in outputs.items():
+            for key, prediction in zip(keys, predictions):
+                if "pred_roll" in prediction:
+                    print(
+                        f"{key} {name}: roll {float(prediction['pred_roll']):.2f} "
+                        f"pitch {float(prediction['pred_pitch']):.2f} "
+                        f"vfov {float(prediction['pred_general_vfov']):.2f}"
+                    )
+    print(f"separate: {separate:.2f} s, shared features: {shared:.2f} s")
+    print(ensemble.stats())
+
+
+if __name__ == "__main__":
+    main()
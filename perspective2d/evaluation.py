@@ -0,0 +1,317 @@
+"""
+Latency and camera-parameter error of PerspectiveFields across settings.
+
+Annotations use the json format of the test splits under `datasets/`: a
+"data" list whose entries have a "file_name" relative to the image root, the
+ground truth "roll" and "pitch" in degrees, and either "vfov" (degrees) or the
+"focal_length" and "height" in pixels:
+
+    python -m perspective2d.evaluation --dataset datasets/gsv/gsv_test_crop_uniform.json \\
+        --root datasets/gsv --resolutions 224 320 512
+
+prints one row per internal resolution with the mean latency per image and
+the mean / median absolute roll, pitch and vfov errors. Without `--dataset`
+the bundled images are used and only latency is reported.
+
+`--block3-depths 18 12 9 6` sweeps the number of stage-3 backbone blocks
+instead (see `MixVisionTransformer.set_block3`), optionally with
+`--block3-mode uniform` or an adaptive `--block3-exit-tol`.
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from .perspectivefields import PerspectiveFields
+
+PARAMS = ("roll", "pitch", "vfov")
+
+
+def load_annotations(path, root=None, limit=None):
+    """
+    Entries without ground truth roll, pitch and vfov (or height and
+    focal_length) are skipped with a warning.
+
+    Returns:
+        list: dicts with the absolute "file_name" and ground truth "roll",
+            "pitch" and "vfov" in degrees.
+
+    Raises:
+        ValueError: if no entry of `path` has the ground truth, e.g. for the
+            *_crop and *_warp files of stanford2d3d and tartanair, which only
+            reference field maps.
+    """
+    with open(path) as f:
+        data = json.load(f)["data"]
+    root = root if root is not None else os.path.dirname(path)
+    annotations = []
+    missing = {}
+    for entry in data[:limit]:
+        field = _missing_field(entry)
+        if field is not None:
+            missing[field] = missing.get(field, 0) + 1
+            continue
+        if "vfov" in entry:
+            vfov = entry["vfov"]
+        else:
+            vfov = math.degrees(
+                2 * math.atan(entry["height"] / 2 / entry["focal_length"])
+            )
+        annotations.append(
+            {
+                "file_name": os.path.join(root, entry["file_name"]),
+                "roll": entry["roll"],
+                "pitch": entry["pitch"],
+                "vfov": vfov,
+            }
+        )
+    if missing and not annotations:
+        raise ValueError(
+            f"{path} has no camera parameter ground truth, "
+            f"missing field(s): {sorted(missing)}"
+        )
+    if missing:
+        warnings.warn(
+            f"Skipped {sum(missing.values())} entries of {path} without "
+            f"ground truth, missing field(s): {sorted(missing)}"
+        )
+    return annotations
+
+
+def _missing_field(entry):
+    for field in ("file_name", "roll", "pitch"):
+        if field not in entry:
+            return field
+    if "vfov" not in entry and not ("height" in entry and "focal_length" in entry):
+        return "vfov"
+    return None
+
+
+def _predicted(prediction, key):
+    if key == "vfov" and "pred_vfov" not in prediction:
+        key = "general_vfov"
+    value = prediction.get("pred_" + key)
+    return None if value is None else float(value)
+
+
+def evaluate(
+    model,
+    imgs,
+    annotations=None,
+    batch_size=1,
+    warmup=1,
+    output_mode="params",
+    **kwargs,
+):
+    """
+    Time `model` on `imgs` and compare its camera parameters to `annotations`.
+
+    Args:
+        model (PerspectiveFields): the model to run.
+        imgs (list): BGR uint8 images, decoded before timing.
+        annotations (list): ground truth per image, see :func:`load_annotations`,
+            or None to only measure latency.
+        batch_size (int): images per `inference_batch` call.
+        warmup (int): untimed batches run first.
+        output_mode (str): see `PerspectiveFields.inference_batch`.
+        **kwargs: passed to `inference_batch`, e.g. `internal_resolution`.
+
+    Returns:
+        dict: "latency_ms" per image, and the "<param>_mean" / "<param>_median"
+            absolute errors in degrees (None without ground truth or ParamNet).
+    """
+    batches = [imgs[i : i + batch_size] for i in range(0, len(imgs), batch_size)]
+    with torch.no_grad():
+        for batch in batches[:warmup]:
+            model.inference_batch(batch, output_mode=output_mode, **kwargs)
+        predictions = []
+        start = time.perf_counter()
+        for batch in batches:
+            predictions += model.inference_batch(
+                batch, output_mode=output_mode, **kwargs
+            )
+            if model.device.type == "cuda":
+                torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+    row = {"latency_ms": elapsed / len(imgs) * 1000}
+    for key in PARAMS:
+        errors = None
+        if annotations is not None:
+            pred = [_predicted(p, key) for p in predictions]
+            if None not in pred:
+                gt = [a[key] for a in annotations]
+                errors = np.abs(np.array(pred) - np.array(gt))
+        row[f"{key}_mean"] = None if errors is None else float(errors.mean())
+        row[f"{key}_median"] = None if errors is None else float(np.median(errors))
+    return row
+
+
+def sweep(model, imgs, annotations=None, resolutions=(None,), **kwargs):
+    """
+    :func:`evaluate` at each internal resolution (None for the training one).
+
+    Returns:
+        list: rows with the "resolution" and the results of :func:`evaluate`.
+    """
+    rows = []
+    for resolution in resolutions:
+        row = evaluate(
+            model, imgs, annotations, internal_resolution=resolution, **kwargs
+        )
+        rows.append({"resolution": resolution or model.aug.new_h, **row})
+    return rows
+
+
+def depth_sweep(
+    model,
+    imgs,
+    annotations=None,
+    depths=(None,),
+    mode="prefix",
+    exit_tol=None,
+    **kwargs,
+):
+    """
+    :func:`evaluate` with each number of stage-3 backbone blocks (None for all
+    of them), see `MixVisionTransformer.set_block3`. The block settings of the
+    model are restored afterwards.
+
+    Returns:
+        list: rows with the "block3" depth, the mean number of blocks that ran
+            ("block3_run", lower than "block3" with an early exit) and the
+            results of :func:`evaluate`.
+    """
+    backbone = model.backbone
+    previous = (
+        backbone.block3_depth,
+        backbone.block3_mode,
+        backbone.block3_exit_tol,
+        backbone.block3_min_depth,
+    )
+    blocks_run = []
+    handle = backbone.register_forward_hook(
+        lambda module, inputs, outputs: blocks_run.append(module.last_block3_depth)
+    )
+    rows = []
+    try:
+        for depth in depths:
+            backbone.set_block3(depth, mode, exit_tol)
+            blocks_run.clear()
+            row = evaluate(model, imgs, annotations, **kwargs)
+            rows.append(
+                {
+                    "block3": depth or len(backbone.block3),
+                    "block3_run": float(np.mean(blocks_run)),
+                    **row,
+                }
+            )
+    finally:
+        handle.remove()
+        backbone.set_block3(*previous)
+    return rows
+
+
+def format_table(rows, key="resolution", extra=()):
+    """
+    Markdown table of :func:`sweep` or :func:`depth_sweep` results, with the
+    `extra` columns after `key`.
+    """
+    columns = [key, *extra, "latency_ms"] + [
+        f"{p}_{stat}" for p in PARAMS for stat in ("mean", "median")
+    ]
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for row in rows:
+        cells = [_format_cell(row[c]) for c in columns]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def _format_cell(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Latency vs. camera parameter error of PerspectiveFields"
+    )
+    parser.add_argument("--version", default="Paramnet-360Cities-edina-centered")
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--dataset", default=None, help="annotation json")
+    parser.add_argument("--root", default=None, help="image root of the dataset")
+    parser.add_argument("--images", default=None, help="images without annotations")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument(
+        "--resolutions",
+        type=int,
+        nargs="+",
+        default=None,
+        help="internal resolutions to sweep (default 224 320 512), or the one "
+        "to sweep the block3 depths at",
+    )
+    parser.add_argument(
+        "--block3-depths", type=int, nargs="+", default=None, help="e.g. 18 12 9 6"
+    )
+    parser.add_argument("--block3-mode", default="prefix", help="prefix or uniform")
+    parser.add_argument("--block3-exit-tol", type=float, default=None)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--resize-mode", default="resize")
+    parser.add_argument("--json", default=None, help="also write the rows here")
+    return parser
+
+
+def main(args=None):
+    from .parity import load_images
+
+    args = get_parser().parse_args(args)
+    annotations = None
+    if args.dataset is not None:
+        annotations = load_annotations(args.dataset, args.root, args.limit)
+        imgs = load_images([a["file_name"] for a in annotations])
+    else:
+        images = args.images or os.path.join(
+            os.path.dirname(__file__), "..", "assets", "imgs"
+        )
+        imgs = load_images(images)[: args.limit]
+    model = (
+        PerspectiveFields(
+            args.version, precision=args.precision, resize_mode=args.resize_mode
+        )
+        .eval()
+        .to(args.device)
+    )
+    if args.block3_depths is not None:
+        rows = depth_sweep(
+            model,
+            imgs,
+            annotations,
+            args.block3_depths,
+            args.block3_mode,
+            args.block3_exit_tol,
+            batch_size=args.batch_size,
+            internal_resolution=args.resolutions[0] if args.resolutions else None,
+        )
+        print(format_table(rows, key="block3", extra=("block3_run",)))
+    else:
+        resolutions = args.resolutions or [224, 320, 512]
+        rows = sweep(model, imgs, annotations, resolutions, batch_size=args.batch_size)
+        print(format_table(rows))
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
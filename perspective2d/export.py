@@ -0,0 +1,259 @@
+"""
+Tensor-in/tensor-out inference core of PerspectiveFields and cached traced
+artifacts.
+
+The core maps normalized NCHW images to the network-resolution fields and the
+raw ParamNet regression outputs, without any of the per-image Python logic of
+`PerspectiveFields.forward`, so it can be traced or exported. Traced cores are
+cached on disk, keyed by model version, weights, attention implementation,
+input resolution, device and torch version:
+
+    python -m perspective2d.export --version Paramnet-360Cities-edina-centered
+
+The same core can be written to ONNX, together with the metadata needed to pre-
+and postprocess without torch (see :mod:`perspective2d.onnx_runtime`):
+
+    python -m perspective2d.export --version Paramnet-360Cities-edina-centered --onnx pf.onnx
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import torch
+from torch import nn
+
+from .registry import default_cache_dir
+
+
+class InferenceCore(nn.Module):
+    """
+    Graph-capturable part of a :class:`PerspectiveFields` model.
+
+    Args:
+        model (PerspectiveFields): model whose modules (and weights) are shared.
+
+    Inputs:
+        images (Tensor): (N, 3, H, W) normalized images.
+
+    Returns:
+        tuple: gravity (N, 2 or C, H, W) and latitude (N, 1 or C, H, W) fields
+            as returned by the heads, and the raw ParamNet regression (N, P);
+            P is 0 for models without ParamNet.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        heads = model.persformer_heads
+        assert heads.gravity_on and heads.latitude_on
+        self.backbone = model.backbone
+        self.ll_enc = model.ll_enc
+        self.persformer_heads = heads
+        self.param_net = model.param_net
+
+    def forward(self, images):
+        features = {
+            "hl": self.backbone(images),
+            "ll": self.ll_enc(images),
+        }
+        results = self.persformer_heads.inference(features)
+        gravity, latitude = results["pred_gravity"], results["pred_latitude"]
+        if self.param_net is None:
+            params = gravity.new_zeros((gravity.shape[0], 0))
+        else:
+            params = self.param_net.regress(gravity, latitude)
+        return gravity, latitude, params
+
+
+def weights_fingerprint(model):
+    """
+    Short hash of the model weights, cheap enough to compute at start-up.
+    """
+    with torch.no_grad():
+        sums = [t.detach().float().sum().reshape(1) for t in _weight_tensors(model)]
+        digest = hashlib.sha1(torch.cat(sums).cpu().numpy().tobytes())
+    return digest.hexdigest()[:12]
+
+
+def _weight_tensors(model):
+    for t in model.state_dict().values():
+        # quantized models also hold dtypes and packed parameters
+        if isinstance(t, torch.Tensor) and t.is_floating_point():
+            yield t
+    for module in model.modules():
+        # dynamically quantized Linear layers keep their weights packed
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            yield module.weight().dequantize()
+            if module.bias() is not None:
+                yield module.bias()
+
+
+def artifact_path(model, height, width, cache_dir=None):
+    """
+    Cache path of the traced core of `model` for `height` x `width` inputs.
+    """
+    cache_dir = cache_dir or os.path.join(default_cache_dir(), "traced")
+    tag = "-".join(
+        [
+            model.version,
+            f"{height}x{width}",
+            model.device.type,
+            model.quantize or "float",
+            model.attn_impl,
+            "optimized" if model.optimized else "reference",
+            "nhwc" if model.memory_format == torch.channels_last else "nchw",
+            f"block3-{model.backbone.block3_mode}-{model.backbone.block3_depth}",
+            weights_fingerprint(model),
+            f"torch{torch.__version__}",
+        ]
+    )
+    return os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", tag) + ".pt")
+
+
+def trace_core(model, height=None, width=None, cache_dir=None):
+    """
+    Load the traced core of `model` from the cache, tracing it on a miss.
+
+    Args:
+        model (PerspectiveFields): model in eval mode.
+        height, width (int): input resolution, defaults to the resolution the
+            model resizes images to.
+        cache_dir (str): directory of the artifacts, defaults to
+            `default_cache_dir()/traced`.
+
+    Returns:
+        torch.jit.ScriptModule: module with the interface of :class:`InferenceCore`.
+    """
+    if model.backbone.block3_exit_tol is not None:
+        raise ValueError(
+            "The block3 early exit depends on the input and cannot be traced"
+        )
+    height = height or model.aug.new_h
+    width = width or model.aug.new_w
+    path = artifact_path(model, height, width, cache_dir)
+    if os.path.exists(path):
+        return torch.jit.load(path, map_location=model.device)
+    example = torch.zeros(1, 3, height, width, device=model.device)
+    with torch.no_grad():
+        traced = torch.jit.trace(InferenceCore(model).eval(), example)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so concurrent workers never load a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.jit.save(traced, tmp_path)
+    os.replace(tmp_path, path)
+    return traced
+
+
+def onnx_metadata(model):
+    """
+    Pre- and postprocessing settings of `model`, stored in exported ONNX files.
+    """
+    cfg = model.cfg
+    meta = {
+        "version": model.version,
+        "input_size": [model.aug.new_h, model.aug.new_w],
+        "input_format": model.input_format,
+        "pixel_mean": cfg.MODEL.PIXEL_MEAN,
+        "pixel_std": cfg.MODEL.PIXEL_STD,
+        "gravity": {
+            "loss_type": cfg.MODEL.GRAVITY_DECODER.LOSS_TYPE,
+            "num_classes": cfg.MODEL.GRAVITY_DECODER.NUM_CLASSES,
+        },
+        "latitude": {
+            "loss_type": cfg.MODEL.LATITUDE_DECODER.LOSS_TYPE,
+            "num_classes": cfg.MODEL.LATITUDE_DECODER.NUM_CLASSES,
+        },
+        "param_net": None,
+    }
+    if model.param_net is not None:
+        meta["param_net"] = {
+            "name": cfg.MODEL.PARAM_DECODER.NAME,
+            "recover_pp": cfg.MODEL.RECOVER_PP,
+            "predict_params": list(cfg.MODEL.PARAM_DECODER.PREDICT_PARAMS),
+            "factors": getattr(model.param_net, "factors", None),
+        }
+    return meta
+
+
+def export_onnx(model, path, height=None, width=None, opset_version=17):
+    """
+    Write the inference core of `model` to an ONNX file with a dynamic batch
+    dimension. The settings from :func:`onnx_metadata` are stored as JSON under
+    the "perspective2d" metadata key.
+
+    Args:
+        model (PerspectiveFields): model in eval mode, not quantized.
+        path (str): output .onnx file.
+        height, width (int): input resolution, defaults to the resolution the
+            model resizes images to.
+        opset_version (int): ONNX opset.
+
+    Returns:
+        str: `path`.
+    """
+    import onnx
+
+    if model.quantize is not None:
+        raise ValueError("Quantized models cannot be exported to ONNX")
+    height = height or model.aug.new_h
+    width = width or model.aug.new_w
+    example = torch.zeros(1, 3, height, width, device=model.device)
+    with torch.no_grad():
+        torch.onnx.export(
+            InferenceCore(model).eval(),
+            (example,),
+            path,
+            input_names=["images"],
+            output_names=["gravity", "latitude", "params"],
+            dynamic_axes={
+                "images": {0: "batch"},
+                "gravity": {0: "batch"},
+                "latitude": {0: "batch"},
+                "params": {0: "batch"},
+            },
+            opset_version=opset_version,
+            dynamo=False,
+        )
+    onnx_model = onnx.load(path)
+    entry = onnx_model.metadata_props.add()
+    entry.key = "perspective2d"
+    entry.value = json.dumps(onnx_metadata(model))
+    onnx.save(onnx_model, path)
+    return path
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Trace and cache the PerspectiveFields inference core"
+    )
+    parser.add_argument("--version", default="Paramnet-360Cities-edina-centered")
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--height", type=int, default=None)
+    parser.add_argument("--width", type=int, default=None)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument(
+        "--onnx", default=None, help="write an ONNX file instead of tracing"
+    )
+    return parser
+
+
+def main(args=None):
+    from .perspectivefields import PerspectiveFields
+
+    args = get_parser().parse_args(args)
+    model = PerspectiveFields(args.version).eval().to(args.device)
+    if args.onnx is not None:
+        print(export_onnx(model, args.onnx, args.height, args.width))
+        return
+    model.trace_core(args.height, args.width, cache_dir=args.cache_dir)
+    height = args.height or model.aug.new_h
+    width = args.width or model.aug.new_w
+    print(artifact_path(model, height, width, args.cache_dir))
+
+
+if __name__ == "__main__":
+    main()
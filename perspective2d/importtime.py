@@ -0,0 +1,160 @@
+"""
+Import-time budget check.
+
+Imports each entry point in a fresh interpreter under `python -X importtime`
+and fails if it pulls in a dependency it should only load on first use, or if
+importing it takes longer than a budget (10 s by default):
+
+    python -m perspective2d.importtime --budget 8
+
+Exits with status 1 on a violation, so it can run in CI.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# dependencies each entry point must not import eagerly
+CHECKS = {
+    # the package itself only resolves its attributes on access
+    "perspective2d": ("torch", "cv2", "matplotlib", "scipy", "sklearn", "equilib"),
+    # inference only needs torch, timm and OpenCV; plotting and panorama
+    # helpers, and scipy for general_vfov models, load on first use
+    "perspective2d.perspectivefields": (
+        "matplotlib",
+        "scipy",
+        "sklearn",
+        "equilib",
+        "imageio",
+    ),
+    # the ONNX runner works without torch, also imported from the package,
+    # which goes through its module __getattr__
+    "perspective2d.onnx_runtime": ("torch", "matplotlib", "sklearn", "equilib"),
+    "from perspective2d import onnx_runtime": (
+        "torch",
+        "matplotlib",
+        "sklearn",
+        "equilib",
+    ),
+}
+
+# seconds per entry point; importing torch dominates perspectivefields
+DEFAULT_BUDGET = 10.0
+
+# a plain import statement: importlib.import_module is not timed by -X importtime
+_SCRIPT = "import json, sys\n{}\nprint(json.dumps(sorted(sys.modules)))"
+
+
+def _statement(entry):
+    """
+    Import statement and timed module name of a module or "from ... import ..."
+    entry of :data:`CHECKS`.
+    """
+    if entry.startswith("from "):
+        _, package, _, name = entry.split()
+        return entry, f"{package}.{name}"
+    return f"import {entry}", entry
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        dict: module name -> (self, cumulative) import time in microseconds.
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(module, python=sys.executable):
+    """
+    Import `module` (a module name or a "from ... import ..." statement) in a
+    new interpreter.
+
+    Returns:
+        tuple: the set of modules loaded afterwards and the parsed import times,
+            see :func:`parse_importtime`.
+    """
+    proc = subprocess.run(
+        [
+            python,
+            "-X",
+            "importtime",
+            "-W",
+            "ignore",
+            "-c",
+            _SCRIPT.format(_statement(module)[0]),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    return set(json.loads(proc.stdout.splitlines()[-1])), parse_importtime(proc.stderr)
+
+
+def check(module, forbidden=(), budget=None, top=5):
+    """
+    Returns:
+        tuple: list of violations (empty if the check passed) and a text report.
+    """
+    loaded, times = measure(module)
+    total = times.get(_statement(module)[1], (0, 0))[1] / 1e6
+    errors = []
+    eager = sorted(
+        name for name in forbidden if any(m.split(".")[0] == name for m in loaded)
+    )
+    if eager:
+        errors.append(f"{module} imports {', '.join(eager)}")
+    if budget is not None and total > budget:
+        errors.append(f"{module} takes {total:.2f}s to import (budget {budget:.2f}s)")
+    slowest = sorted(times.items(), key=lambda kv: kv[1][0], reverse=True)[:top]
+    lines = [f"{module}: {total:.2f}s, {len(loaded)} modules"]
+    lines += [f"  {us / 1e3:8.1f}ms  {name}" for name, (us, _) in slowest]
+    return errors, "\n".join(lines)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Check the import time budget")
+    parser.add_argument(
+        "--modules",
+        nargs="*",
+        default=None,
+        help="entry points to check (default: all known)",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help="maximum cumulative import time in seconds per module "
+        f"(default: {DEFAULT_BUDGET})",
+    )
+    parser.add_argument(
+        "--top", type=int, default=5, help="number of slowest modules to show"
+    )
+    return parser
+
+
+def main(args=None):
+    args = get_parser().parse_args(args)
+    errors = []
+    for module in args.modules or CHECKS:
+        module_errors, report = check(
+            module, CHECKS.get(module, ()), args.budget, args.top
+        )
+        print(report)
+        errors += module_errors
+    for error in errors:
+        print(f"FAIL: {error}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,12 @@ import torch.nn.functional as F
 from timm.models.layers import DropPath, trunc_normal_
 
 
+def _is_meta(module):
+    # modules built on the meta device get their weights from a checkpoint, and
+    # the initializers would only run slow meta decompositions
+    return any(p.is_meta for p in module.parameters(recurse=False))
+
+
 class Block(nn.Module):
     r"""ConvNeXt Block. There are two equivalent implementations:
     (1) DwConv -> LayerNorm (channels_first) -> 1x1 Conv -> GELU -> 1x1 Conv; all in (N, C, H, W)
@@ -36,6 +42,7 @@ class Block(nn.Module):
         )  # pointwise/1x1 convs, implemented with linear layers
         self.act = nn.GELU()
         self.pwconv2 = nn.Linear(4 * dim, dim)
+        self.layer_scale_init_value = layer_scale_init_value
         self.gamma = (
             nn.Parameter(layer_scale_init_value * torch.ones(dim), requires_grad=True)
             if layer_scale_init_value > 0
@@ -43,6 +50,11 @@ class Block(nn.Module):
         )
         self.drop_path = DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
 
+    def reset_parameters(self):
+        # the layer scale only, submodules initialize themselves
+        if self.gamma is not None:
+            nn.init.constant_(self.gamma, self.layer_scale_init_value)
+
     def forward(self, x):
         input = x
         x = self.dwconv(x)
@@ -104,7 +116,10 @@ class ConvNeXt(nn.Module):
         self.stages = (
             nn.ModuleList()
         )  # 4 feature resolution stages, each consisting of multiple residual blocks
-        dp_rates = [x.item() for x in torch.linspace(0, drop_path_rate, sum(depths))]
+        dp_rates = [
+            x.item()
+            for x in torch.linspace(0, drop_path_rate, sum(depths), device="cpu")
+        ]
         cur = 0
         for i in range(4):
             stage = nn.Sequential(
@@ -133,6 +148,8 @@ class ConvNeXt(nn.Module):
         self.num_classes = num_classes
 
     def _init_weights(self, m):
+        if _is_meta(m):
+            return
         if isinstance(m, (nn.Conv2d, nn.Linear)):
             trunc_normal_(m.weight, std=0.02)
             nn.init.constant_(m.bias, 0)
@@ -169,6 +186,10 @@ class LayerNorm(nn.Module):
             raise NotImplementedError
         self.normalized_shape = (normalized_shape,)
 
+    def reset_parameters(self):
+        nn.init.ones_(self.weight)
+        nn.init.zeros_(self.bias)
+
     def forward(self, x):
         if self.data_format == "channels_last":
             return F.layer_norm(
@@ -8,9 +8,16 @@ from functools import partial
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from timm.models.layers import DropPath, to_2tuple, trunc_normal_
 
 
+def _is_meta(module):
+    # modules built on the meta device get their weights from a checkpoint, and
+    # the initializers would only run slow meta decompositions
+    return any(p.is_meta for p in module.parameters(recurse=False))
+
+
 class Mlp(nn.Module):
     def __init__(
         self,
@@ -32,6 +39,8 @@ class Mlp(nn.Module):
         self.apply(self._init_weights)
 
     def _init_weights(self, m):
+        if _is_meta(m):
+            return
         if isinstance(m, nn.Linear):
             trunc_normal_(m.weight, std=0.02)
             if isinstance(m, nn.Linear) and m.bias is not None:
@@ -56,6 +65,13 @@ class Mlp(nn.Module):
         return x
 
 
+# "math" materializes the full attention matrix, "sdpa" uses the fused
+# F.scaled_dot_product_attention kernels, "chunked" bounds the attention matrix
+# to `chunk_size` queries at a time
+ATTENTION_IMPLS = ("math", "sdpa", "chunked")
+BLOCK3_MODES = ("prefix", "uniform")
+
+
 class Attention(nn.Module):
     def __init__(
         self,
@@ -66,11 +82,17 @@ class Attention(nn.Module):
         attn_drop=0.0,
         proj_drop=0.0,
         sr_ratio=1,
+        attn_impl="math",
+        chunk_size=1024,
     ):
         super().__init__()
         assert (
             dim % num_heads == 0
         ), f"dim {dim} should be divided by num_heads {num_heads}."
+        if attn_impl not in ATTENTION_IMPLS:
+            raise ValueError(f"Unknown attention implementation: {attn_impl}")
+        self.attn_impl = attn_impl
+        self.chunk_size = chunk_size
 
         self.dim = dim
         self.num_heads = num_heads
@@ -91,6 +113,8 @@ class Attention(nn.Module):
         self.apply(self._init_weights)
 
     def _init_weights(self, m):
+        if _is_meta(m):
+            return
         if isinstance(m, nn.Linear):
             trunc_normal_(m.weight, std=0.02)
             if isinstance(m, nn.Linear) and m.bias is not None:
@@ -130,15 +154,104 @@ class Attention(nn.Module):
             )
         k, v = kv[0], kv[1]
 
+        x = self._attention(q, k, v)
+        x = x.transpose(1, 2).reshape(B, N, C)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+
+        return x
+
+    def _attention(self, q, k, v):
+        if self.attn_impl == "sdpa":
+            return self._attend_sdpa(q, k, v)
+        if self.attn_impl == "chunked":
+            return torch.cat(
+                [
+                    self._attend(q[:, :, i : i + self.chunk_size], k, v)
+                    for i in range(0, q.shape[2], self.chunk_size)
+                ],
+                dim=2,
+            )
+        return self._attend(q, k, v)
+
+    def _attend(self, q, k, v):
         attn = (q @ k.transpose(-2, -1)) * self.scale
         attn = attn.softmax(dim=-1)
         attn = self.attn_drop(attn)
+        return attn @ v
+
+    def _attend_sdpa(self, q, k, v):
+        default_scale = q.shape[-1] ** -0.5
+        if self.scale != default_scale:
+            q = q * (self.scale / default_scale)
+        dropout_p = self.attn_drop.p if self.training else 0.0
+        return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+
+
+class FusedAttention(Attention):
+    """
+    Inference variant of a loaded :class:`Attention`, sharing its weights.
+
+    Without spatial reduction (`sr_ratio == 1`) the q and kv projections are
+    concatenated into a single `qkv` linear layer. With spatial reduction, the
+    tokens are handed to the `sr` convolution as a channels-last view of the
+    feature map instead of being copied to NCHW, and its output is read back
+    as tokens without another copy.
+    """
+
+    def __init__(self, attn):
+        nn.Module.__init__(self)
+        self.dim = attn.dim
+        self.num_heads = attn.num_heads
+        self.scale = attn.scale
+        self.attn_impl = attn.attn_impl
+        self.chunk_size = attn.chunk_size
+        self.attn_drop = attn.attn_drop
+        self.proj = attn.proj
+        self.proj_drop = attn.proj_drop
+        self.sr_ratio = attn.sr_ratio
+        if self.sr_ratio > 1:
+            self.q = attn.q
+            self.kv = attn.kv
+            self.sr = attn.sr
+            self.norm = attn.norm
+        else:
+            self.qkv = nn.Linear(
+                self.dim,
+                3 * self.dim,
+                bias=attn.q.bias is not None,
+                device=attn.q.weight.device,
+                dtype=attn.q.weight.dtype,
+            )
+            with torch.no_grad():
+                self.qkv.weight.copy_(torch.cat([attn.q.weight, attn.kv.weight]))
+                if attn.q.bias is not None:
+                    self.qkv.bias.copy_(torch.cat([attn.q.bias, attn.kv.bias]))
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
-        x = self.proj(x)
-        x = self.proj_drop(x)
+    def forward(self, x, H, W):
+        B, N, C = x.shape
+        head_dim = C // self.num_heads
+        if self.sr_ratio > 1:
+            q = self.q(x).reshape(B, N, self.num_heads, head_dim).transpose(1, 2)
+            x_ = x.reshape(B, H, W, C).permute(0, 3, 1, 2)
+            x_ = self.norm(self.sr(x_).flatten(2).transpose(1, 2))
+            kv = (
+                self.kv(x_)
+                .reshape(B, -1, 2, self.num_heads, head_dim)
+                .permute(2, 0, 3, 1, 4)
+            )
+            k, v = kv[0], kv[1]
+        else:
+            qkv = (
+                self.qkv(x)
+                .reshape(B, N, 3, self.num_heads, head_dim)
+                .permute(2, 0, 3, 1, 4)
+            )
+            q, k, v = qkv[0], qkv[1], qkv[2]
 
-        return x
+        x = self._attention(q, k, v)
+        x = x.transpose(1, 2).reshape(B, N, C)
+        return self.proj_drop(self.proj(x))
 
 
 class Block(nn.Module):
@@ -181,6 +294,8 @@ class Block(nn.Module):
         self.apply(self._init_weights)
 
     def _init_weights(self, m):
+        if _is_meta(m):
+            return
         if isinstance(m, nn.Linear):
             trunc_normal_(m.weight, std=0.02)
             if isinstance(m, nn.Linear) and m.bias is not None:
@@ -226,6 +341,8 @@ class OverlapPatchEmbed(nn.Module):
         self.apply(self._init_weights)
 
     def _init_weights(self, m):
+        if _is_meta(m):
+            return
         if isinstance(m, nn.Linear):
             trunc_normal_(m.weight, std=0.02)
             if isinstance(m, nn.Linear) and m.bias is not None:
@@ -271,6 +388,14 @@ class MixVisionTransformer(nn.Module):
         super().__init__()
         self.num_classes = num_classes
         self.depths = depths
+        # layout of the stage outputs; channels-last keeps the token order
+        self.memory_format = torch.contiguous_format
+        # reduced-depth inference of stage 3, see set_block3
+        self.block3_depth = None
+        self.block3_mode = "prefix"
+        self.block3_exit_tol = None
+        self.block3_min_depth = 1
+        self.last_block3_depth = None
 
         # patch_embed
         self.patch_embed1 = OverlapPatchEmbed(
@@ -304,7 +429,8 @@ class MixVisionTransformer(nn.Module):
 
         # transformer encoder
         dpr = [
-            x.item() for x in torch.linspace(0, drop_path_rate, sum(depths))
+            x.item()
+            for x in torch.linspace(0, drop_path_rate, sum(depths), device="cpu")
         ]  # stochastic depth decay rule
         cur = 0
         self.block1 = nn.ModuleList(
@@ -392,6 +518,8 @@ class MixVisionTransformer(nn.Module):
         self.apply(self._init_weights)
 
     def _init_weights(self, m):
+        if _is_meta(m):
+            return
         if isinstance(m, nn.Linear):
             trunc_normal_(m.weight, std=0.02)
             if isinstance(m, nn.Linear) and m.bias is not None:
@@ -446,42 +574,99 @@ class MixVisionTransformer(nn.Module):
             nn.Linear(self.embed_dim, num_classes) if num_classes > 0 else nn.Identity()
         )
 
-    def forward_features(self, x):
+    def set_attn_impl(self, attn_impl, chunk_size=None):
+        """
+        Switch the attention implementation of all blocks, see
+        `ATTENTION_IMPLS`. The weights are shared by all implementations.
+        """
+        if attn_impl not in ATTENTION_IMPLS:
+            raise ValueError(f"Unknown attention implementation: {attn_impl}")
+        if attn_impl == "sdpa" and not hasattr(F, "scaled_dot_product_attention"):
+            raise ValueError("attn_impl='sdpa' needs torch >= 2.0")
+        for module in self.modules():
+            if isinstance(module, Attention):
+                module.attn_impl = attn_impl
+                if chunk_size is not None:
+                    module.chunk_size = chunk_size
+
+    def optimize_for_inference(self):
+        """
+        Replace the attention and depth-wise convolution modules of all blocks
+        by :class:`FusedAttention` and :class:`FusedDWConv`, in place, once the
+        weights are loaded. The state dict then holds `qkv` instead of `q` and
+        `kv` for blocks without spatial reduction.
+        """
+        for name in ("block1", "block2", "block3", "block4"):
+            for blk in getattr(self, name):
+                if not isinstance(blk.attn, FusedAttention):
+                    blk.attn = FusedAttention(blk.attn)
+                if not isinstance(blk.mlp.dwconv, FusedDWConv):
+                    blk.mlp.dwconv = FusedDWConv(blk.mlp.dwconv)
+        return self
+
+    def set_block3(self, depth=None, mode="prefix", exit_tol=None, min_depth=1):
+        """
+        Run fewer of the blocks of stage 3, which holds most of the backbone
+        computation, trading accuracy for speed.
+
+        Args:
+            depth (int): number of blocks to run, None for all of them.
+            mode (str): which blocks to keep, "prefix" (the first `depth`) or
+                "uniform" (`depth` blocks evenly spaced over the stage).
+            exit_tol (float): additionally stop once a block changes the
+                tokens by less than this fraction of their norm (for every image
+                of the batch), after at least `min_depth` blocks. The exit
+                depth then depends on the input, so it cannot be traced.
+            min_depth (int): blocks always run before an early exit.
+        """
+        if mode not in BLOCK3_MODES:
+            raise ValueError(f"Unknown block3 mode: {mode}")
+        num_blocks = len(self.block3)
+        if depth is not None and not 0 < depth <= num_blocks:
+            raise ValueError(f"block3 depth must be in [1, {num_blocks}], got {depth}")
+        self.block3_depth = depth
+        self.block3_mode = mode
+        self.block3_exit_tol = exit_tol
+        self.block3_min_depth = min_depth
+
+    def _blocks(self, stage):
+        blocks = list(getattr(self, f"block{stage}"))
+        depth = self.block3_depth
+        if stage != 3 or depth is None or depth >= len(blocks):
+            return blocks
+        if self.block3_mode == "uniform" and depth > 1:
+            step = (len(blocks) - 1) / (depth - 1)
+            return [blocks[round(i * step)] for i in range(depth)]
+        return blocks[:depth]
+
+    def forward_stage(self, x, stage):
+        """
+        Run stage `stage` (1 to 4) on the image or the output of the previous
+        stage.
+        """
         B = x.shape[0]
-        outs = []
-
-        # stage 1
-        x, H, W = self.patch_embed1(x)
-        for i, blk in enumerate(self.block1):
-            x = blk(x, H, W)
-        x = self.norm1(x)
-        x = x.reshape(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
-        outs.append(x)
-
-        # stage 2
-        x, H, W = self.patch_embed2(x)
-        for i, blk in enumerate(self.block2):
-            x = blk(x, H, W)
-        x = self.norm2(x)
-        x = x.reshape(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
-        outs.append(x)
-
-        # stage 3
-        x, H, W = self.patch_embed3(x)
-        for i, blk in enumerate(self.block3):
-            x = blk(x, H, W)
-        x = self.norm3(x)
-        x = x.reshape(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
-        outs.append(x)
-
-        # stage 4
-        x, H, W = self.patch_embed4(x)
-        for i, blk in enumerate(self.block4):
-            x = blk(x, H, W)
-        x = self.norm4(x)
-        x = x.reshape(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
-        outs.append(x)
+        x, H, W = getattr(self, f"patch_embed{stage}")(x)
+        exit_tol = self.block3_exit_tol if stage == 3 else None
+        for i, blk in enumerate(self._blocks(stage), 1):
+            y = blk(x, H, W)
+            if exit_tol is not None and i >= self.block3_min_depth:
+                change = (y - x).flatten(1).norm(dim=1) / x.flatten(1).norm(dim=1)
+                x = y
+                if change.max() < exit_tol:
+                    break
+            else:
+                x = y
+        if stage == 3:
+            self.last_block3_depth = i
+        x = getattr(self, f"norm{stage}")(x)
+        x = x.reshape(B, H, W, -1).permute(0, 3, 1, 2)
+        return x.contiguous(memory_format=self.memory_format)
 
+    def forward_features(self, x):
+        outs = []
+        for stage in range(1, 5):
+            x = self.forward_stage(x, stage)
+            outs.append(x)
         return outs
 
     def forward(self, x):
@@ -508,6 +693,23 @@ class DWConv(nn.Module):
         return x
 
 
+class FusedDWConv(nn.Module):
+    """
+    Inference variant of a loaded :class:`DWConv`, sharing its weights, that
+    treats the tokens as the channels-last layout of the feature map instead of
+    copying them to NCHW and back.
+    """
+
+    def __init__(self, dwconv):
+        super().__init__()
+        self.dwconv = dwconv.dwconv
+
+    def forward(self, x, H, W):
+        B, N, C = x.shape
+        x = self.dwconv(x.reshape(B, H, W, C).permute(0, 3, 1, 2))
+        return x.flatten(2).transpose(1, 2)
+
+
 class mit_b3(MixVisionTransformer):
     def __init__(self, **kwargs):
         super().__init__(
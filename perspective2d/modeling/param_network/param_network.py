@@ -1,4 +1,3 @@
-import cv2
 import numpy as np
 import torch
 from torch import nn
@@ -43,30 +42,36 @@ class ParamNet(nn.Module):
         self.backbone = ConvNeXt(num_classes=num_classes)
         self.loss_weight = cfg.MODEL.PARAM_DECODER.LOSS_WEIGHT
 
-    def forward(self, predictions, batched_inputs=None):
-        images = torch.cat(
-            (predictions["pred_gravity"], predictions["pred_latitude"]), dim=1
-        )
+    def regress(self, gravity, latitude):
+        """
+        Raw regression outputs (N, 5) from the network-resolution fields.
+        """
+        images = torch.cat((gravity, latitude), dim=1)
+        return self.backbone(images)
 
-        x = self.backbone(images)
+    def decode(self, x):
+        """
+        Camera parameters from the output of :meth:`regress`.
+        """
+        if self.cfg.MODEL.RECOVER_PP:
+            return {
+                "pred_roll": x[:, 0] * 90.0,
+                "pred_pitch": x[:, 1] * 90.0,
+                "pred_rel_focal": x[:, 2],
+                "pred_rel_pp": x[:, 3:],
+            }
+        return {
+            "pred_roll": x[:, 0] * 90.0,
+            "pred_pitch": x[:, 1] * 90.0,
+            "pred_vfov": x[:, 2] * 90.0,
+            "pred_rel_focal": 1 / 2 / torch.tan(x[:, 2]),
+        }
+
+    def forward(self, predictions, batched_inputs=None):
+        x = self.regress(predictions["pred_gravity"], predictions["pred_latitude"])
         # x[:,:2] = torch.clip(x[:,:2], -1, 1)
         if not self.training:
-            if self.cfg.MODEL.RECOVER_PP:
-                param = {
-                    "pred_roll": x[:, 0] * 90.0,
-                    "pred_pitch": x[:, 1] * 90.0,
-                    "pred_rel_focal": x[:, 2],
-                    "pred_rel_pp": x[:, 3:],
-                }
-            else:
-                param = {
-                    "pred_roll": x[:, 0] * 90.0,
-                    "pred_pitch": x[:, 1] * 90.0,
-                    "pred_vfov": x[:, 2] * 90.0,
-                    "pred_rel_focal": 1 / 2 / torch.tan(x[:, 2]),
-                }
-
-            return param
+            return self.decode(x)
 
         targets_dict = {}
         if self.cfg.MODEL.RECOVER_RPF:
@@ -88,14 +93,14 @@ class ParamNet(nn.Module):
                         for x in batched_inputs
                     ]
                 )
-            targets_dict["rpf"] = targets.to(images.device)
+            targets_dict["rpf"] = targets.to(x.device)
         else:
-            targets_dict["rpf"] = torch.zeros((len(x), 3)).to(images.device)
+            targets_dict["rpf"] = torch.zeros((len(x), 3)).to(x.device)
         if self.cfg.MODEL.RECOVER_PP:
-            targets = torch.FloatTensor([x["rel_pp"] for x in batched_inputs])
-            targets_dict["rel_pp"] = targets.to(images.device)
+            targets = torch.FloatTensor([b["rel_pp"] for b in batched_inputs])
+            targets_dict["rel_pp"] = targets.to(x.device)
         else:
-            targets_dict["rel_pp"] = torch.zeros((len(x), 2)).to(images.device)
+            targets_dict["rel_pp"] = torch.zeros((len(x), 2)).to(x.device)
         losses = self.losses(x, targets_dict)
         return losses
 
@@ -128,6 +133,8 @@ class ParamNet(nn.Module):
         return losses
 
     def visualize(self, predictions, batched_inputs):
+        import cv2
+
         with torch.no_grad():
             images = torch.cat(
                 (predictions["pred_gravity"], predictions["pred_latitude"]), dim=1
@@ -190,35 +197,45 @@ class ParamNetConvNextRegress(nn.Module):
             "general_vfov": 90.0,
         }
 
-    def forward(self, predictions, batched_inputs=None):
-        images = torch.cat(
-            (predictions["pred_gravity"], predictions["pred_latitude"]), dim=1
-        )
+    def regress(self, gravity, latitude):
+        """
+        Raw regression outputs (N, len(PREDICT_PARAMS)) from the
+        network-resolution fields.
+        """
+        images = torch.cat((gravity, latitude), dim=1)
         images = F.interpolate(images, (self.input_size, self.input_size))
+        return self.backbone(images)
 
-        x = self.backbone(images)
-        # x[:,:2] = torch.clip(x[:,:2], -1, 1)
-        if not self.training:
-            param = {}
-            for idx, key in enumerate(self.cfg.MODEL.PARAM_DECODER.PREDICT_PARAMS):
-                param["pred_" + key] = x[:, idx] * self.factors[key]
+    def decode(self, x):
+        """
+        Camera parameters from the output of :meth:`regress`.
+        """
+        param = {}
+        for idx, key in enumerate(self.cfg.MODEL.PARAM_DECODER.PREDICT_PARAMS):
+            param["pred_" + key] = x[:, idx] * self.factors[key]
 
-            # make output contain everything
-            if "pred_rel_cx" not in param and "pred_rel_cy" not in param:
-                param["pred_rel_cx"] = param["pred_rel_cy"] = torch.FloatTensor([0])
-            if "pred_general_vfov" not in param:
-                param["pred_general_vfov"] = param["pred_vfov"]
-            if "pred_rel_focal" not in param:
-                param["pred_rel_focal"] = torch.FloatTensor(
-                    general_vfov_to_focal(
-                        to_numpy(param["pred_rel_cx"]),
-                        to_numpy(param["pred_rel_cy"]),
-                        1,
-                        to_numpy(param["pred_general_vfov"]),
-                        degree=True,
-                    )
+        # make output contain everything
+        if "pred_rel_cx" not in param and "pred_rel_cy" not in param:
+            param["pred_rel_cx"] = param["pred_rel_cy"] = x.new_zeros(len(x))
+        if "pred_general_vfov" not in param:
+            param["pred_general_vfov"] = param["pred_vfov"]
+        if "pred_rel_focal" not in param:
+            param["pred_rel_focal"] = torch.FloatTensor(
+                general_vfov_to_focal(
+                    to_numpy(param["pred_rel_cx"]),
+                    to_numpy(param["pred_rel_cy"]),
+                    1,
+                    to_numpy(param["pred_general_vfov"]),
+                    degree=True,
                 )
-            return param
+            ).to(x.device)
+        return param
+
+    def forward(self, predictions, batched_inputs=None):
+        x = self.regress(predictions["pred_gravity"], predictions["pred_latitude"])
+        # x[:,:2] = torch.clip(x[:,:2], -1, 1)
+        if not self.training:
+            return self.decode(x)
 
         targets = []
         for batched_input in batched_inputs:
@@ -226,7 +243,7 @@ class ParamNetConvNextRegress(nn.Module):
             for key in self.cfg.MODEL.PARAM_DECODER.PREDICT_PARAMS:
                 target.append(batched_input[key] / self.factors[key])
             targets.append(target)
-        targets = torch.FloatTensor(targets).to(images.device)
+        targets = torch.FloatTensor(targets).to(x.device)
         losses = self.losses(x, targets)
         return losses
 
@@ -241,6 +258,8 @@ class ParamNetConvNextRegress(nn.Module):
         return losses
 
     def visualize(self, predictions, batched_inputs):
+        import cv2
+
         with torch.no_grad():
             images = torch.cat(
                 (predictions["pred_gravity"], predictions["pred_latitude"]), dim=1
@@ -3,7 +3,7 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
-from ...utils import decode_bin, draw_up_field, pf_postprocess
+from ...utils import decode_bin, draw_up_field, group_by_size, pf_postprocess
 from ...utils.config import configurable
 from . import BaseDecodeHead
 from .decode_head import MLP, FeatureFusionBlock
@@ -178,7 +178,7 @@ class GravityDecoder(BaseDecodeHead):
     def forward(self, features, targets=None):
         x = self.layers(features)
         if self.loss_type == "regression":
-            x = F.normalize(x, dim=1)
+            x = F.normalize(x.float(), dim=1)
         if self.training:
             return x, self.losses(x, targets)
         else:
@@ -190,7 +190,7 @@ class GravityDecoder(BaseDecodeHead):
     def inference(self, features):
         x = self.layers(features)
         if self.loss_type == "regression":
-            x = F.normalize(x, dim=1)
+            x = F.normalize(x.float(), dim=1)
         x = F.interpolate(
             x, scale_factor=self.common_stride, mode="bilinear", align_corners=False
         )
@@ -235,30 +235,33 @@ class GravityDecoder(BaseDecodeHead):
         return losses
 
     def postprocess(self, results, batched_inputs, images):
-        processed_results = []
-        for result, input_per_image in zip(results, batched_inputs):
-            height = input_per_image.get("height")
-            width = input_per_image.get("width")
+        vec_originals = [None] * len(batched_inputs)
+        for (height, width), idx in group_by_size(batched_inputs).items():
+            result = results if len(idx) == len(results) else results[idx]
+            # the resolution the network ran at, or the valid region of
+            # letterboxed inputs (see PerspectiveFields._letterbox)
+            image_size = batched_inputs[idx[0]].get(
+                "image_size", tuple(results.shape[-2:])
+            )
             if self.loss_type == "regression":
                 vec = result
             elif self.loss_type == "classification":
-                vec = decode_bin(result.argmax(dim=0), self.num_classes)
+                vec = decode_bin(result.argmax(dim=1), self.num_classes)
+                vec = vec.transpose(0, 1).contiguous()
             else:
                 raise NotImplementedError
-            scale = (
-                torch.tensor(
-                    [[width / self.image_size[1]], [height / self.image_size[0]]]
-                )
-                .unsqueeze(-1)
-                .to(vec.device)
-            )
-            vec_original = vec * scale
-            vec_original = pf_postprocess(vec_original, self.image_size, height, width)
-            vec_original = F.normalize(vec_original, dim=0)
-            processed_results.append(
-                {"pred_gravity": result, "pred_gravity_original": vec_original}
+            scale = torch.tensor([width / image_size[1], height / image_size[0]]).to(
+                vec.device
             )
-        return processed_results
+            vec_original = vec * scale.view(1, 2, 1, 1)
+            vec_original = pf_postprocess(vec_original, image_size, height, width)
+            vec_original = F.normalize(vec_original, dim=1)
+            for i, v in zip(idx, vec_original):
+                vec_originals[i] = v
+        return [
+            {"pred_gravity": result, "pred_gravity_original": vec_original}
+            for result, vec_original in zip(results, vec_originals)
+        ]
 
     def visualize(self, img, pred, gt):
         if self.loss_type == "regression":
@@ -3,7 +3,12 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
-from ...utils import decode_bin_latitude, draw_latitude_field, pf_postprocess
+from ...utils import (
+    decode_bin_latitude,
+    draw_latitude_field,
+    group_by_size,
+    pf_postprocess,
+)
 from ...utils.config import configurable
 from . import BaseDecodeHead
 from .decode_head import MLP, FeatureFusionBlock
@@ -193,30 +198,36 @@ class LatitudeDecoder(BaseDecodeHead):
         return x
 
     def postprocess(self, results, batched_inputs, images):
-        processed_results = []
-        for result, input_per_image in zip(results, batched_inputs):
-            height = input_per_image.get("height")
-            width = input_per_image.get("width")
+        latimaps = [None] * len(batched_inputs)
+        for (height, width), idx in group_by_size(batched_inputs).items():
+            result = results if len(idx) == len(results) else results[idx]
+            # the resolution the network ran at, or the valid region of
+            # letterboxed inputs (see PerspectiveFields._letterbox)
+            image_size = batched_inputs[idx[0]].get(
+                "image_size", tuple(results.shape[-2:])
+            )
             if self.loss_type == "regression":
-                latimap = pf_postprocess(result, self.image_size, height, width)[0]
+                latimap = pf_postprocess(result, image_size, height, width)[:, 0]
                 latimap = torch.asin(latimap)
                 latimap = torch.rad2deg(latimap)
             elif self.loss_type == "classification":
-                latimap_bin = result.argmax(dim=0)
-                latimap = decode_bin_latitude(latimap_bin, self.num_classes).unsqueeze(
-                    0
-                )
-                latimap = pf_postprocess(latimap, self.image_size, height, width)[0]
+                latimap_bin = result.argmax(dim=1)
+                latimap = decode_bin_latitude(latimap_bin, self.num_classes)
+                latimap = pf_postprocess(
+                    latimap.unsqueeze(1), image_size, height, width
+                )[:, 0]
             else:
                 raise NotImplementedError
-            processed_results.append(
-                {
-                    "pred_latitude": result,
-                    "pred_latitude_original": latimap,
-                    "pred_latitude_original_mode": "deg",
-                }
-            )
-        return processed_results
+            for i, l in zip(idx, latimap):
+                latimaps[i] = l
+        return [
+            {
+                "pred_latitude": result,
+                "pred_latitude_original": latimap,
+                "pred_latitude_original_mode": "deg",
+            }
+            for result, latimap in zip(results, latimaps)
+        ]
 
     def losses(self, predictions, targets):
         predictions = (
@@ -1,4 +1,5 @@
 import inspect
+from functools import partial
 from typing import Optional
 
 import numpy as np
@@ -6,6 +7,7 @@ import torch
 from torch import nn
 from torch.nn import functional as F
 
+from ...structures import LazyDict
 from ...utils.config import configurable
 from .gravity_head import build_gravity_decoder
 from .latitude_head import build_latitude_decoder
@@ -80,7 +82,9 @@ class StandardPersformerHeads(torch.nn.Module):
             results["pred_latitude"] = x
         return results
 
-    def postprocess(self, results, batched_inputs, images):
+    def postprocess(self, results, batched_inputs, images, lazy=False):
+        if lazy:
+            return self._postprocess_lazy(results, batched_inputs, images)
         processed_results = []
         if self.gravity_on:
             processed_gravity = self.gravity_head.postprocess(
@@ -100,6 +104,38 @@ class StandardPersformerHeads(torch.nn.Module):
             processed_results.append({**p_g, **p_l})
         return processed_results
 
+    def _postprocess_lazy(self, results, batched_inputs, images):
+        """
+        Per-image results whose original-resolution fields are only upsampled
+        when they are first accessed.
+        """
+        heads = {}
+        if self.gravity_on:
+            heads["pred_gravity"] = self.gravity_head
+        if self.latitude_on:
+            heads["pred_latitude"] = self.latitude_head
+        processed_results = []
+        for i, input_per_image in enumerate(batched_inputs):
+            data, lazy = {}, {}
+            for key, head in heads.items():
+                # a copy of this sample only, so that a kept result does not
+                # hold on to the fields of the whole batch; the heads read
+                # the sizes from input_per_image, not from `images`
+                result = results[key][i : i + 1].clone()
+                data[key] = result[0]
+                lazy[key + "_original"] = partial(
+                    _postprocess_one,
+                    head,
+                    result,
+                    input_per_image,
+                    None,
+                    key + "_original",
+                )
+            if self.latitude_on:
+                data["pred_latitude_original_mode"] = "deg"
+            processed_results.append(LazyDict(data, lazy))
+        return processed_results
+
     def visualize(self, img, feature, target):
         with torch.no_grad():
             results = self.inference(feature)
@@ -136,6 +172,10 @@ class StandardPersformerHeads(torch.nn.Module):
         return score_maps
 
 
+def _postprocess_one(head, result, input_per_image, images, key):
+    return head.postprocess(result, [input_per_image], images)[0][key]
+
+
 def build_persformer_heads(cfg, input_shape):
     persformer_name = cfg.MODEL.PERSFORMER_HEADS.NAME
     if persformer_name == "StandardPersformerHeads":
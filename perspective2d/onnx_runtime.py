@@ -0,0 +1,286 @@
+"""
+PerspectiveFields on onnxruntime, without torch.
+
+Runs a model written by :func:`perspective2d.export.export_onnx`. Pre- and
+postprocessing follow `PerspectiveFields` using NumPy, PIL and OpenCV, and
+predictions hold NumPy arrays under the same keys:
+
+    from perspective2d.onnx_runtime import OnnxPerspectiveFields
+    pf_model = OnnxPerspectiveFields("paramnet_360cities_edina_rpf.onnx")
+    predictions = pf_model.inference(img_bgr=cv2.imread("assets/imgs/cityscape.jpg"))
+
+`python -m perspective2d.onnx_runtime --version ...` exports a model and checks
+it against the eager PyTorch model on the bundled images (requires torch);
+`--random-weights` checks a seeded random initialization offline.
+"""
+
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .camera import general_vfov_to_focal
+
+
+class OnnxPerspectiveFields:
+    """
+    Args:
+        path (str): ONNX file exported by :func:`perspective2d.export.export_onnx`.
+        providers (list): onnxruntime execution providers.
+        sess_options (onnxruntime.SessionOptions): optional session options.
+    """
+
+    def __init__(self, path, providers=("CPUExecutionProvider",), sess_options=None):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(
+            path, sess_options=sess_options, providers=list(providers)
+        )
+        meta = self.session.get_modelmeta().custom_metadata_map
+        if "perspective2d" not in meta:
+            raise ValueError(f"{path} was not exported by perspective2d.export")
+        self.meta = json.loads(meta["perspective2d"])
+        self.version = self.meta["version"]
+        self.input_size = tuple(self.meta["input_size"])
+        self.pixel_mean = np.asarray(self.meta["pixel_mean"], np.float32)
+        self.pixel_std = np.asarray(self.meta["pixel_std"], np.float32)
+
+    def preprocess_batch(self, img_bgr_list):
+        """
+        Returns:
+            tuple: normalized images of shape (N, 3, H', W') and a list of dicts
+                holding the original "height" and "width" of each image.
+        """
+        new_h, new_w = self.input_size
+        images = np.empty((len(img_bgr_list), 3, new_h, new_w), np.float32)
+        batched_inputs = []
+        for i, img in enumerate(img_bgr_list):
+            height, width = img.shape[:2]
+            # antialiased bilinear resize in float, like the torch preprocessing
+            img = np.stack(
+                [
+                    np.asarray(
+                        Image.fromarray(c, mode="F").resize(
+                            (new_w, new_h), Image.BILINEAR
+                        )
+                    )
+                    for c in img.transpose(2, 0, 1).astype(np.float32)
+                ]
+            )
+            if self.meta["input_format"] == "RGB":
+                # whether the model expects BGR inputs or RGB
+                img = img[::-1]
+            mean, std = self.pixel_mean[:, None, None], self.pixel_std[:, None, None]
+            images[i] = (img - mean) / std
+            batched_inputs.append({"height": height, "width": width})
+        return images, batched_inputs
+
+    def inference(self, img_bgr):
+        return self.inference_batch([img_bgr])[0]
+
+    def inference_batch(self, img_bgr_list):
+        """
+        Args:
+            img_bgr_list (list): HxWx3 BGR uint8 images.
+
+        Returns:
+            list: per-image prediction dicts with the keys of
+                `PerspectiveFields.inference_batch`, holding NumPy arrays.
+        """
+        images, batched_inputs = self.preprocess_batch(img_bgr_list)
+        gravity, latitude, params = self.session.run(None, {"images": images})
+        processed_results = []
+        for i, input_per_image in enumerate(batched_inputs):
+            height, width = input_per_image["height"], input_per_image["width"]
+            processed_results.append(
+                {
+                    "pred_gravity": gravity[i],
+                    "pred_gravity_original": self._postprocess_gravity(
+                        gravity[i], height, width
+                    ),
+                    "pred_latitude": latitude[i],
+                    "pred_latitude_original": self._postprocess_latitude(
+                        latitude[i], height, width
+                    ),
+                    "pred_latitude_original_mode": "deg",
+                }
+            )
+        if self.meta["param_net"] is not None:
+            param = self._decode_params(params)
+            if "pred_general_vfov" not in param:
+                param["pred_general_vfov"] = param["pred_vfov"]
+            if "pred_rel_cx" not in param:
+                param["pred_rel_cx"] = np.zeros_like(param["pred_vfov"])
+            if "pred_rel_cy" not in param:
+                param["pred_rel_cy"] = np.zeros_like(param["pred_vfov"])
+            for i, result in enumerate(processed_results):
+                result.update({k: v[i] for k, v in param.items()})
+        return processed_results
+
+    def _postprocess_gravity(self, result, height, width):
+        head = self.meta["gravity"]
+        if head["loss_type"] == "regression":
+            vec = result
+        elif head["loss_type"] == "classification":
+            vec = _decode_bin(result.argmax(axis=0), head["num_classes"])
+        else:
+            raise NotImplementedError
+        scale = np.array(
+            [width / self.input_size[1], height / self.input_size[0]], np.float32
+        )
+        vec = _resize(vec * scale.reshape(2, 1, 1), height, width)
+        # same as F.normalize(vec, dim=0)
+        return vec / np.maximum(np.linalg.norm(vec, axis=0, keepdims=True), 1e-12)
+
+    def _postprocess_latitude(self, result, height, width):
+        head = self.meta["latitude"]
+        if head["loss_type"] == "regression":
+            latimap = _resize(result, height, width)[0]
+            return np.degrees(np.arcsin(latimap))
+        elif head["loss_type"] == "classification":
+            latimap = _decode_bin_latitude(result.argmax(axis=0), head["num_classes"])
+            return _resize(latimap[None], height, width)[0]
+        raise NotImplementedError
+
+    def _decode_params(self, x):
+        # mirrors ParamNet.decode / ParamNetConvNextRegress.decode
+        param_net = self.meta["param_net"]
+        if param_net["name"] == "ParamNet":
+            if param_net["recover_pp"]:
+                return {
+                    "pred_roll": x[:, 0] * 90.0,
+                    "pred_pitch": x[:, 1] * 90.0,
+                    "pred_rel_focal": x[:, 2],
+                    "pred_rel_pp": x[:, 3:],
+                }
+            return {
+                "pred_roll": x[:, 0] * 90.0,
+                "pred_pitch": x[:, 1] * 90.0,
+                "pred_vfov": x[:, 2] * 90.0,
+                "pred_rel_focal": 1 / 2 / np.tan(x[:, 2]),
+            }
+        param = {}
+        for idx, key in enumerate(param_net["predict_params"]):
+            param["pred_" + key] = x[:, idx] * param_net["factors"][key]
+        if "pred_rel_cx" not in param and "pred_rel_cy" not in param:
+            param["pred_rel_cx"] = param["pred_rel_cy"] = np.zeros(len(x), np.float32)
+        if "pred_general_vfov" not in param:
+            param["pred_general_vfov"] = param["pred_vfov"]
+        if "pred_rel_focal" not in param:
+            param["pred_rel_focal"] = general_vfov_to_focal(
+                param["pred_rel_cx"],
+                param["pred_rel_cy"],
+                1,
+                param["pred_general_vfov"],
+                degree=True,
+            ).astype(np.float32)
+        return param
+
+
+def _resize(x, height, width):
+    """
+    Bilinear (align_corners=False) resize of a (C, h, w) float array.
+    """
+    channels = [
+        cv2.resize(c, (width, height), interpolation=cv2.INTER_LINEAR) for c in x
+    ]
+    return np.stack(channels)
+
+
+def _decode_bin(angle_bin, num_bin):
+    # NumPy version of perspective2d.utils.decode_bin
+    angle = (angle_bin * (360 / (num_bin - 1)) - 180) / 180 * np.pi
+    vector_field = np.stack((np.cos(angle), np.sin(angle))).astype(np.float32)
+    vector_field[:, angle_bin == num_bin - 1] = 0
+    return vector_field
+
+
+def _decode_bin_latitude(binmap, num_classes):
+    # NumPy version of perspective2d.utils.decode_bin_latitude
+    bin_size = 180 / num_classes
+    bin_centers = np.arange(-90, 90, bin_size, dtype=np.float32) + bin_size / 2
+    return bin_centers[binmap]
+
+
+def check_parity(version=None, path=None, images=None, model=None, weights=None):
+    """
+    Export a model to ONNX and compare the runner against the eager model.
+
+    Args:
+        version (str): `model_zoo` version to build when `model` is None.
+        path (str): where to write the ONNX file; by default it goes to a
+            temporary directory that is removed afterwards.
+        images (str): image directory, defaults to the bundled images.
+        model (PerspectiveFields): model to export instead of building one.
+        weights: passed to `PerspectiveFields`; False keeps a random
+            initialization seeded with 0, so nothing is downloaded.
+
+    Returns:
+        dict: parity report, see :func:`perspective2d.parity.parity_report`;
+            :func:`perspective2d.parity.max_abs_error` gives the largest
+            difference over all outputs.
+    """
+    import tempfile
+
+    import torch
+
+    from .export import export_onnx
+    from .parity import load_images, parity_report
+    from .perspectivefields import PerspectiveFields
+
+    images = images or os.path.join(os.path.dirname(__file__), "..", "assets", "imgs")
+    if model is None:
+        if weights is False:
+            torch.manual_seed(0)
+        model = PerspectiveFields(version, weights=weights).eval()
+    imgs = load_images(images)
+    with torch.no_grad():
+        references = model.inference_batch(imgs)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onnx_path = path or os.path.join(tmp_dir, f"{model.version}.onnx")
+        export_onnx(model, onnx_path)
+        candidates = OnnxPerspectiveFields(onnx_path).inference_batch(imgs)
+    return parity_report(references, candidates)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Check an exported ONNX model against the PyTorch model"
+    )
+    parser.add_argument("--version", default="Paramnet-360Cities-edina-centered")
+    parser.add_argument("--onnx", default=None, help="also keep the ONNX file here")
+    parser.add_argument("--images", default=None)
+    parser.add_argument(
+        "--random-weights",
+        action="store_true",
+        help="check a seeded random initialization, nothing is downloaded",
+    )
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=None,
+        help="exit with status 1 if an output differs by more than this",
+    )
+    return parser
+
+
+def main(args=None):
+    from .parity import format_report, max_abs_error
+
+    args = get_parser().parse_args(args)
+    report = check_parity(
+        args.version,
+        args.onnx,
+        args.images,
+        weights=False if args.random_weights else None,
+    )
+    print(format_report(report))
+    if args.atol is not None and max_abs_error(report) > args.atol:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
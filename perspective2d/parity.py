@@ -0,0 +1,201 @@
+"""
+Numerical parity between two sets of PerspectiveFields predictions.
+
+Used to check that faster inference modes (reduced precision, quantization,
+exported graphs, ...) stay close to the fp32 reference:
+
+    python -m perspective2d.parity --precision bf16 --images assets/imgs
+    python -m perspective2d.parity --quantize dynamic --device cpu
+    python -m perspective2d.parity --optimize --atol 1e-3
+"""
+
+import argparse
+import copy
+import math
+import os
+
+import numpy as np
+import torch
+
+# gravity fields are unit vectors, so they are also compared by angle
+_VECTOR_FIELDS = ("pred_gravity", "pred_gravity_original")
+
+
+def _to_numpy(value):
+    if isinstance(value, torch.Tensor):
+        return value.detach().float().cpu().numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
+def compare_predictions(reference, candidate):
+    """
+    Compare two prediction dicts of the same image.
+
+    Args:
+        reference (dict): prediction used as ground truth.
+        candidate (dict): prediction to check.
+
+    Returns:
+        dict: key -> {"max_abs", "mean_abs"} for every array-valued key present
+            in both dicts; gravity fields also get "max_deg" and "mean_deg",
+            the angle between the predicted up-vectors in degrees.
+    """
+    out = {}
+    for key in reference:
+        if key not in candidate:
+            continue
+        ref, cand = reference[key], candidate[key]
+        if not isinstance(ref, (torch.Tensor, np.ndarray, float, int)):
+            continue
+        ref, cand = _to_numpy(ref), _to_numpy(cand)
+        if ref.shape != cand.shape:
+            raise ValueError(f"Shape mismatch for {key}: {ref.shape} vs {cand.shape}")
+        err = np.abs(ref - cand)
+        stats = {"max_abs": float(err.max()), "mean_abs": float(err.mean())}
+        if key in _VECTOR_FIELDS:
+            cos = (ref * cand).sum(0) / (
+                np.linalg.norm(ref, axis=0) * np.linalg.norm(cand, axis=0) + 1e-12
+            )
+            deg = np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+            stats["max_deg"] = float(deg.max())
+            stats["mean_deg"] = float(deg.mean())
+        out[key] = stats
+    return out
+
+
+def parity_report(references, candidates):
+    """
+    Aggregate :func:`compare_predictions` over a list of images.
+
+    Returns:
+        dict: key -> statistics, maxima are the worst image and means are
+            averaged over images.
+    """
+    report = {}
+    for reference, candidate in zip(references, candidates):
+        for key, stats in compare_predictions(reference, candidate).items():
+            agg = report.setdefault(key, {})
+            for name, value in stats.items():
+                if name.startswith("max"):
+                    agg[name] = max(agg.get(name, 0.0), value)
+                else:
+                    agg[name] = agg.get(name, 0.0) + value / len(references)
+    return report
+
+
+def precision_parity_report(model, img_bgr_list, precision, output_mode="full"):
+    """
+    Compare `precision` inference of `model` against its fp32 outputs.
+    """
+    with torch.no_grad():
+        references = model.inference_batch(
+            img_bgr_list, output_mode=output_mode, precision="fp32"
+        )
+        candidates = model.inference_batch(
+            img_bgr_list, output_mode=output_mode, precision=precision
+        )
+    return parity_report(references, candidates)
+
+
+def quantization_parity_report(model, img_bgr_list, output_mode="full"):
+    """
+    Compare a dynamically quantized copy of `model` against `model` on CPU.
+    """
+    from .quantization import quantize_dynamic
+
+    model = model.cpu()
+    quantized = quantize_dynamic(copy.deepcopy(model))
+    with torch.no_grad():
+        references = model.inference_batch(img_bgr_list, output_mode=output_mode)
+        candidates = quantized.inference_batch(img_bgr_list, output_mode=output_mode)
+    return parity_report(references, candidates)
+
+
+def optimization_parity_report(model, img_bgr_list, output_mode="full"):
+    """
+    Compare an optimized copy of `model` (see `MixVisionTransformer.
+    optimize_for_inference`) against `model`.
+    """
+    optimized = copy.deepcopy(model)
+    optimized.backbone.optimize_for_inference()
+    optimized.optimized = True
+    with torch.no_grad():
+        references = model.inference_batch(img_bgr_list, output_mode=output_mode)
+        candidates = optimized.inference_batch(img_bgr_list, output_mode=output_mode)
+    return parity_report(references, candidates)
+
+
+def max_abs_error(report):
+    """
+    Largest "max_abs" difference of a report.
+    """
+    return max(stats["max_abs"] for stats in report.values())
+
+
+def format_report(report):
+    names = ["max_abs", "mean_abs", "max_deg", "mean_deg"]
+    lines = ["{:<28}".format("key") + "".join(f"{n:>12}" for n in names)]
+    for key, stats in sorted(report.items()):
+        values = [stats.get(n, math.nan) for n in names]
+        lines.append(f"{key:<28}" + "".join(f"{v:>12.4g}" for v in values))
+    return "\n".join(lines)
+
+
+def load_images(path):
+    from .streaming import iter_source, load_frame
+
+    return [load_frame(item) for _, item in iter_source(path)]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="PerspectiveFields parity report")
+    parser.add_argument("--version", default="Paramnet-360Cities-edina-centered")
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--precision", default="bf16")
+    parser.add_argument(
+        "--quantize",
+        default=None,
+        help="compare this quantization mode instead of a precision",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="compare the optimized backbone instead of a precision",
+    )
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=None,
+        help="exit with status 1 if any difference exceeds this",
+    )
+    parser.add_argument(
+        "--images",
+        default=os.path.join(os.path.dirname(__file__), "..", "assets", "imgs"),
+        help="image, directory or video to compare on",
+    )
+    return parser
+
+
+def main(args=None):
+    from .perspectivefields import PerspectiveFields
+
+    args = get_parser().parse_args(args)
+    model = PerspectiveFields(args.version).eval().to(args.device)
+    imgs = load_images(args.images)
+    if args.optimize:
+        report = optimization_parity_report(model, imgs)
+    elif args.quantize == "dynamic":
+        report = quantization_parity_report(model, imgs)
+    elif args.quantize is not None:
+        raise ValueError(f"Unknown quantization mode: {args.quantize}")
+    else:
+        report = precision_parity_report(model, imgs, args.precision)
+    print(format_report(report))
+    if args.atol is not None and max_abs_error(report) > args.atol:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
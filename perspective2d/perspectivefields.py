@@ -1,3 +1,6 @@
+import contextlib
+import inspect
+import warnings
 from importlib import resources
 from pathlib import Path
 
@@ -11,6 +14,24 @@ from .config import get_perspective2d_cfg_defaults
 from .modeling.backbone import build_backbone
 from .modeling.param_network import build_param_net
 from .modeling.persformer_heads import build_persformer_heads
+from . import registry
+from .model_zoo import model_zoo
+from .quantization import QUANTIZATION_MODES, quantize_dynamic
+from .structures import BatchPredictions
+
+
+_PIL_RESIZE_TO_INTERPOLATE_MODE = {
+    Image.NEAREST: "nearest",
+    Image.BILINEAR: "bilinear",
+    Image.BICUBIC: "bicubic",
+}
+_INTERPOLATE_ANTIALIAS = "antialias" in inspect.signature(F.interpolate).parameters
+_LOAD_STATE_DICT_ASSIGN = (
+    "assign" in inspect.signature(nn.Module.load_state_dict).parameters
+)
+# meta-device construction needs torch.device as a context manager and
+# load_state_dict(assign=True) to replace the meta tensors
+_META_INIT = _LOAD_STATE_DICT_ASSIGN and hasattr(torch.device, "__enter__")
 
 
 class ResizeTransform:
@@ -52,11 +73,6 @@ class ResizeTransform:
             shape = list(img.shape)
             shape_4d = shape[:2] + [1] * (4 - len(shape)) + shape[2:]
             img = img.view(shape_4d).permute(2, 3, 0, 1)  # hw(c) -> nchw
-            _PIL_RESIZE_TO_INTERPOLATE_MODE = {
-                Image.NEAREST: "nearest",
-                Image.BILINEAR: "bilinear",
-                Image.BICUBIC: "bicubic",
-            }
             mode = _PIL_RESIZE_TO_INTERPOLATE_MODE[interp_method]
             align_corners = None if mode == "nearest" else False
             img = F.interpolate(
@@ -66,6 +82,27 @@ class ResizeTransform:
             ret = img.permute(2, 3, 0, 1).view(shape).numpy()  # nchw -> hw(c)
         return ret
 
+    def apply_tensor(self, img, interp=None):
+        """
+        Resize a batch of float images in one pass.
+
+        Args:
+            img (torch.Tensor): images of shape (N, C, H, W).
+            interp: PIL interpolation method, defaults to the one of this transform.
+
+        Returns:
+            torch.Tensor: resized images of shape (N, C, new_h, new_w).
+        """
+        interp_method = interp if interp is not None else self.interp
+        mode = _PIL_RESIZE_TO_INTERPOLATE_MODE[interp_method]
+        if img.shape[-2:] == (self.new_h, self.new_w):
+            return img
+        kwargs = {"align_corners": None if mode == "nearest" else False}
+        if mode != "nearest" and _INTERPOLATE_ANTIALIAS:
+            # PIL filters with antialiasing when downsampling
+            kwargs["antialias"] = True
+        return F.interpolate(img, (self.new_h, self.new_w), mode=mode, **kwargs)
+
 
 class LowLevelEncoder(nn.Module):
     def __init__(self, feat_dim=64, in_channel=3):
@@ -83,44 +120,72 @@ class LowLevelEncoder(nn.Module):
         return x
 
 
-model_zoo = {
-    "Paramnet-360Cities-edina-centered": {
-        "weights": "https://huggingface.co/spaces/jinlinyi/PerspectiveFields/resolve/main/models/paramnet_360cities_edina_rpf.pth",
-        "config_file": "paramnet_360cities_edina_rpf.yaml",
-        "param": True,
-        "description": "Trained on 360cities and EDINA dataset. Assumes centered principal point. Predicts roll, pitch and fov.",
-    },
-    "Paramnet-360Cities-edina-uncentered": {
-        "weights": "https://huggingface.co/spaces/jinlinyi/PerspectiveFields/resolve/main/models/paramnet_360cities_edina_rpfpp.pth",
-        "config_file": "paramnet_360cities_edina_rpfpp.yaml",
-        "param": True,
-        "description": "Trained on 360cities and EDINA dataset. Predicts roll, pitch, fov and principal point.",
-    },
-    "PersNet-360Cities": {
-        "weights": "https://huggingface.co/spaces/jinlinyi/PerspectiveFields/resolve/main/models/cvpr2023.pth",
-        "config_file": "cvpr2023.yaml",
-        "param": False,
-        "description": "Trained on 360cities. Predicts perspective fields.",
-    },
-    "PersNet_Paramnet-GSV-uncentered": {
-        "weights": "https://huggingface.co/spaces/jinlinyi/PerspectiveFields/resolve/main/models/paramnet_gsv_rpfpp.pth",
-        "config_file": "paramnet_gsv_rpfpp.yaml",
-        "param": True,
-        "description": "Trained on GSV. Predicts roll, pitch, fov and principal point.",
-    },
-    # trained on GSV dataset, predicts Perspective Fields + camera parameters (roll, pitch, fov), assuming centered principal point
-    "PersNet_Paramnet-GSV-centered": {
-        "weights": "https://huggingface.co/spaces/jinlinyi/PerspectiveFields/resolve/main/models/paramnet_gsv_rpf.pth",
-        "config_file": "paramnet_gsv_rpf.yaml",
-        "param": True,
-        "description": "Trained on GSV. Assumes centered principal point. Predicts roll, pitch and fov.",
-    },
-}
+OUTPUT_MODES = ("params", "network", "lazy", "full")
+RESIZE_MODES = ("resize", "pad")
+PRECISIONS = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
 
 
 class PerspectiveFields(nn.Module):
-    def __init__(self, version="Paramnet-360Cities-edina-centered"):
+    def __init__(
+        self,
+        version="Paramnet-360Cities-edina-centered",
+        precision="fp32",
+        quantize=None,
+        weights=None,
+        skip_init=True,
+        resize_mode="resize",
+        cache=None,
+        attn_impl="math",
+        optimize=False,
+        channels_last=False,
+        block3_depth=None,
+    ):
+        """
+        Args:
+            version (str): model name, see :meth:`versions`.
+            weights (str): local checkpoint to load instead of the cached
+                `model_zoo` weights, see :mod:`perspective2d.registry`, or False
+                to keep the random initialization (nothing is downloaded), e.g.
+                for benchmarks.
+            skip_init (bool): build the modules on the meta device and take the
+                parameters from the checkpoint instead of randomly initializing
+                them first. Ignored on torch versions without meta-device
+                construction.
+            precision (str): default inference precision, "fp32", "fp16" or "bf16".
+            quantize (str): None, or "dynamic" for int8 dynamic quantization of
+                the linear layers of the backbone and decode heads (CPU only).
+            resize_mode (str): "resize" warps every image to the training
+                resolution; "pad" keeps the aspect ratio, fitting the image in
+                the training resolution and padding the batch to a size
+                divisible by the backbone, so mixed aspect ratios batch together.
+            cache (ResultCache): optional cache of the predictions of
+                :meth:`inference_batch`, see :mod:`perspective2d.cache`.
+            attn_impl (str): attention implementation of the backbone: "math"
+                (the reference), "sdpa" (fused scaled dot-product attention) or
+                "chunked" (the attention matrix computed for a block of queries
+                at a time). All use the same weights.
+            optimize (bool): once the weights are loaded, fuse the q/kv
+                projections of the backbone attention where possible and run
+                its convolutions on the token layout without NCHW copies, see
+                `MixVisionTransformer.optimize_for_inference`. Outputs match
+                within float tolerance (`python -m perspective2d.parity
+                --optimize`).
+            channels_last (bool): convert the convolution weights to the
+                channels-last (NHWC) memory format once and keep activations in
+                it from the input images through the backbone, decode heads and
+                ParamNet; the oneDNN CPU and cuDNN kernels are usually faster
+                in this layout. Outputs match within float tolerance.
+            block3_depth (int): run only the first `block3_depth` of the 18
+                blocks of backbone stage 3, for faster but less accurate
+                calibration; see `MixVisionTransformer.set_block3` for other
+                block selections and an adaptive early exit, and
+                `python -m perspective2d.evaluation --block3-depths` to choose.
+        """
         super().__init__()
+        if quantize not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantize}")
+        if resize_mode not in RESIZE_MODES:
+            raise ValueError(f"Unknown resize mode: {resize_mode}")
         default_conf = get_perspective2d_cfg_defaults()
         # To get the path
         with resources.path(
@@ -131,17 +196,32 @@ class PerspectiveFields(nn.Module):
         default_conf.freeze()
         self.version = version
         self.param_on = model_zoo[version]["param"]
-        self.cfg = cfg = default_conf
-        self.backbone = build_backbone(cfg)
-        self.ll_enc = LowLevelEncoder()
-        self.persformer_heads = build_persformer_heads(
-            cfg, self.backbone.output_shape()
-        )
-        self.param_net = (
-            build_param_net(cfg)
-            if cfg.MODEL.RECOVER_RPF or cfg.MODEL.RECOVER_PP
-            else None
+        self.precision = _check_precision(precision)
+        self.quantize = None
+        self.resize_mode = resize_mode
+        self.cache = cache
+        self.attn_impl = attn_impl
+        self.optimized = optimize
+        self.memory_format = (
+            torch.channels_last if channels_last else torch.contiguous_format
         )
+        # traced inference cores keyed by (height, width, device type)
+        self._traced = {}
+        self.cfg = cfg = default_conf
+        skip_init = skip_init and _META_INIT and weights is not False
+        with torch.device("meta") if skip_init else contextlib.nullcontext():
+            self.backbone = build_backbone(cfg)
+            self.ll_enc = LowLevelEncoder()
+            self.persformer_heads = build_persformer_heads(
+                cfg, self.backbone.output_shape()
+            )
+            self.param_net = (
+                build_param_net(cfg)
+                if cfg.MODEL.RECOVER_RPF or cfg.MODEL.RECOVER_PP
+                else None
+            )
+        self.backbone.set_attn_impl(attn_impl)
+        self.backbone.set_block3(block3_depth)
         self.register_buffer(
             "pixel_mean", torch.tensor(cfg.MODEL.PIXEL_MEAN).view(-1, 1, 1), False
         )
@@ -160,7 +240,16 @@ class PerspectiveFields(nn.Module):
                 final = getattr(final, l)
             for params in final.parameters():
                 params.requires_grad = False
-        self._init_weights()
+        self._init_weights(weights)
+        if skip_init:
+            self._materialize()
+        if optimize:
+            self.backbone.optimize_for_inference()
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+            self.backbone.memory_format = torch.channels_last
+        if quantize == "dynamic":
+            quantize_dynamic(self)
 
     @property
     def device(self):
@@ -175,57 +264,422 @@ class PerspectiveFields(nn.Module):
     def version(self):
         return self.version
 
-    def _init_weights(self):
-        state_dict = None
-        if self.version in model_zoo:
-            state_dict = torch.hub.load_state_dict_from_url(
-                model_zoo[self.version]["weights"], 
-                map_location=torch.device('cpu'),
-            )
-            self.load_state_dict(state_dict, strict=False)
-        elif self.cfg.MODEL.WEIGHTS is not None:
+    def _init_weights(self, weights=None):
+        if weights is False:
+            return
+        if weights is None and self.version in model_zoo:
+            weights = registry.weights_path(self.version)
+        elif weights is None and self.cfg.MODEL.WEIGHTS:
             path = Path(__file__).parent
-            path = path / "weights/{}.pth".format(self.cfg.MODEL.WEIGHTS)
-            state_dict = torch.load(str(path), map_location="cpu")
+            weights = path / "weights/{}.pth".format(self.cfg.MODEL.WEIGHTS)
+        if weights is None:
+            return
+        # memory-mapped tensors are assigned directly, so the parameters share
+        # the page cache of the checkpoint instead of being copied
+        state_dict = registry.load_checkpoint(str(weights), mmap=True)
+        if _LOAD_STATE_DICT_ASSIGN:
+            self.load_state_dict(state_dict, strict=False, assign=True)
+        else:
+            self.load_state_dict(state_dict, strict=False)
 
-        if state_dict:
-            status = self.load_state_dict(state_dict["model"], strict=False)
+    def _materialize(self):
+        """
+        Allocate the tensors a meta-device construction left without values
+        because the checkpoint did not hold them, initialized as `__init__`
+        would: with the default initialization of their module
+        (`reset_parameters`), then the `_init_weights` hook of the outermost
+        module that applies one (the MiT backbone and ConvNeXt), since that
+        hook runs last in `__init__`.
 
-    @torch.no_grad()
-    def inference(self, img_bgr):
-        original_image = img_bgr.copy()
+        Raises:
+            ValueError: if such a tensor belongs to a module without
+                `reset_parameters`, whose initial values are unknown.
+        """
+        modules = dict(self.named_modules())
+        missing = []
+        for module_name, module in modules.items():
+            tensors = {
+                **dict(module.named_parameters(recurse=False)),
+                **dict(module.named_buffers(recurse=False)),
+            }
+            meta = [name for name, t in tensors.items() if t.is_meta]
+            if not meta:
+                continue
+            missing += [f"{module_name}.{name}" for name in meta]
+            if not hasattr(module, "reset_parameters"):
+                raise ValueError(
+                    f"Weights not found in the checkpoint: {missing}; "
+                    f"{type(module).__name__} cannot initialize them, "
+                    "construct the model with skip_init=False"
+                )
+            loaded = {n: t for n, t in tensors.items() if not t.is_meta}
+            module.to_empty(device="cpu", recurse=False)
+            module.reset_parameters()
+            owner = _init_hook_owner(modules, module_name)
+            if owner is not None:
+                owner._init_weights(module)
+            with torch.no_grad():
+                for name, t in loaded.items():
+                    getattr(module, name).copy_(t)
+        if missing:
+            warnings.warn(f"Weights not found in the checkpoint: {missing}")
+
+    def trace_core(self, height=None, width=None, cache_dir=None):
+        """
+        Trace the tensor-in/tensor-out core of the model for one input
+        resolution (cached on disk, see :mod:`perspective2d.export`) and use it
+        for fp32 inference on inputs of that resolution.
+
+        Returns:
+            torch.jit.ScriptModule: the traced core.
+        """
+        from .export import trace_core
+
+        height = height or self.aug.new_h
+        width = width or self.aug.new_w
+        traced = trace_core(self, height, width, cache_dir=cache_dir)
+        self._traced[(height, width, self.device.type)] = traced
+        return traced
+
+    def _autocast(self, precision):
+        """
+        Autocast context running eligible ops in `precision`; a no-op for fp32.
+        """
+        return torch.autocast(
+            device_type=self.device.type,
+            dtype=PRECISIONS[precision],
+            enabled=precision != "fp32",
+        )
+
+    def _resize_transform(self, internal_resolution=None):
+        """
+        Transform to the network input resolution, the training resolution
+        unless `internal_resolution` (int or (height, width)) is given.
+        """
+        if internal_resolution is None:
+            return self.aug
+        if isinstance(internal_resolution, int):
+            internal_resolution = (internal_resolution, internal_resolution)
+        height, width = internal_resolution
+        divisor = self.backbone.size_divisibility or 1
+        if height <= 0 or width <= 0 or height % divisor or width % divisor:
+            raise ValueError(
+                f"internal_resolution must be a positive multiple of {divisor}, "
+                f"got {internal_resolution}"
+            )
+        if (height, width) == (self.aug.new_h, self.aug.new_w):
+            return self.aug
+        return ResizeTransform(height, width, self.aug.interp)
+
+    def preprocess_batch(self, img_bgr_list, internal_resolution=None):
+        """
+        Vectorized preprocessing of a batch of BGR uint8 images.
+
+        Images sharing the same size are stacked and moved to the model device as
+        uint8, then converted, resized, channel-flipped and normalized by
+        `pixel_mean`/`pixel_std` in one pass per size. With `resize_mode="pad"`
+        see :meth:`_letterbox`.
+
+        Args:
+            img_bgr_list (list | np.ndarray | torch.Tensor): HxWx3 uint8 images,
+                either as a list or already stacked as NxHxWx3.
+            internal_resolution (int | tuple): network input resolution,
+                defaults to the training resolution; see :meth:`inference_batch`.
+
+        Returns:
+            tuple: normalized images of shape (N, 3, H', W') and a list of dicts
+                holding the original "height" and "width" of each image.
+        """
+        stacked = isinstance(img_bgr_list, (np.ndarray, torch.Tensor))
+        if stacked and img_bgr_list.ndim == 4:
+            size = tuple(img_bgr_list.shape[1:3])
+            groups = {size: list(range(len(img_bgr_list)))}
+            stacks = {size: _stack_frames(img_bgr_list)}
+        else:
+            groups = {}
+            for idx, img in enumerate(img_bgr_list):
+                groups.setdefault(tuple(img.shape[:2]), []).append(idx)
+            stacks = {
+                size: _stack_frames([img_bgr_list[i] for i in idx])
+                for size, idx in groups.items()
+            }
+
+        aug = self._resize_transform(internal_resolution)
+        if self.resize_mode == "pad":
+            return self._letterbox(groups, stacks, aug)
+        images = None
+        batched_inputs = [None] * sum(len(idx) for idx in groups.values())
+        for (height, width), idx in groups.items():
+            x = self._normalize(stacks[(height, width)], aug)
+            if len(groups) == 1:
+                images = x
+            else:
+                if images is None:
+                    images = x.new_empty((len(batched_inputs),) + x.shape[1:])
+                images[idx] = x
+            for i in idx:
+                batched_inputs[i] = {"height": height, "width": width}
+        return images, batched_inputs
+
+    def _normalize(self, x, aug):
+        """
+        NxHxWx3 uint8 frames to normalized (N, 3, H', W') inputs resized by `aug`.
+        """
+        x = x.to(self.device, non_blocking=True)
+        # nhwc -> nchw, always a fresh tensor so the ops below can be in-place
+        x = x.permute(0, 3, 1, 2).to(torch.float32, copy=True)
+        x = aug.apply_tensor(x)
         if self.input_format == "RGB":
             # whether the model expects BGR inputs or RGB
-            original_image = original_image[:, :, ::-1]
-        height, width = original_image.shape[:2]
-        image = self.aug.apply_image(original_image)
-        image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
-        inputs = {"image": image, "height": height, "width": width}
-        predictions = self.forward([inputs])[0]
-        return predictions
+            x = x.flip(1)
+        return x.sub_(self.pixel_mean).div_(self.pixel_std)
+
+    def _letterbox(self, groups, stacks, aug):
+        """
+        Resize each image to fit in the resolution of `aug` with its aspect ratio
+        kept, and zero-pad (after normalization) the batch at the bottom and
+        right to a common size divisible by `backbone.size_divisibility`. The
+        valid size of each image is recorded as "image_size" in its dict.
+        """
+        sizes = {}
+        for height, width in groups:
+            scale = min(aug.new_h / height, aug.new_w / width)
+            sizes[(height, width)] = (
+                max(1, round(height * scale)),
+                max(1, round(width * scale)),
+            )
+        divisor = self.backbone.size_divisibility or 1
+        pad_h = -(-max(h for h, _ in sizes.values()) // divisor) * divisor
+        pad_w = -(-max(w for _, w in sizes.values()) // divisor) * divisor
+        num_images = sum(len(idx) for idx in groups.values())
+        images = torch.zeros((num_images, 3, pad_h, pad_w), device=self.device)
+        batched_inputs = [None] * num_images
+        for (height, width), idx in groups.items():
+            new_h, new_w = sizes[(height, width)]
+            images[idx, :, :new_h, :new_w] = self._normalize(
+                stacks[(height, width)], ResizeTransform(new_h, new_w, aug.interp)
+            )
+            for i in idx:
+                batched_inputs[i] = {
+                    "height": height,
+                    "width": width,
+                    "image_size": (new_h, new_w),
+                }
+        return images, batched_inputs
+
+    def _param_net_inputs(self, results, batched_inputs):
+        """
+        Network-resolution fields, cropped to the valid region of letterboxed
+        images and warped to the training resolution, as ParamNet was trained
+        on fields of images resized to it.
+        """
+        size = (self.aug.new_h, self.aug.new_w)
+        gravity = torch.empty(
+            (len(batched_inputs), results["pred_gravity"].shape[1]) + size,
+            device=results["pred_gravity"].device,
+        )
+        latitude = torch.empty(
+            (len(batched_inputs), results["pred_latitude"].shape[1]) + size,
+            device=results["pred_latitude"].device,
+        )
+        network_size = tuple(results["pred_gravity"].shape[-2:])
+        groups = {}
+        for i, input_per_image in enumerate(batched_inputs):
+            image_size = input_per_image.get("image_size", network_size)
+            groups.setdefault(image_size, []).append(i)
+        for (h, w), idx in groups.items():
+            g = F.interpolate(
+                results["pred_gravity"][idx, :, :h, :w],
+                size,
+                mode="bilinear",
+                align_corners=False,
+            )
+            # the warp scales x and y differently, which turns the up vectors
+            scale = g.new_tensor([size[1] / w, size[0] / h]).view(1, 2, 1, 1)
+            gravity[idx] = F.normalize(g * scale, dim=1)
+            latitude[idx] = F.interpolate(
+                results["pred_latitude"][idx, :, :h, :w],
+                size,
+                mode="bilinear",
+                align_corners=False,
+            )
+        return gravity, latitude
+
+    @torch.no_grad()
+    def inference(
+        self, img_bgr, output_mode="full", precision=None, internal_resolution=None
+    ):
+        return self.inference_batch(
+            [img_bgr],
+            output_mode=output_mode,
+            precision=precision,
+            internal_resolution=internal_resolution,
+        )[0]
+
+    @torch.no_grad()
+    def inference_batch(
+        self,
+        img_bgr_list,
+        output_mode="full",
+        precision=None,
+        internal_resolution=None,
+        structured=False,
+    ):
+        """
+        Args:
+            img_bgr_list (list): HxWx3 BGR uint8 images.
+            output_mode (str): which outputs to produce, one of
+                - "params": camera parameters from ParamNet only,
+                - "network": fields at network resolution ("pred_gravity",
+                  "pred_latitude") and camera parameters,
+                - "lazy": as "network", plus "pred_gravity_original" and
+                  "pred_latitude_original" computed on first access,
+                - "full": everything, fields upsampled to the original size.
+            precision (str): "fp32", "fp16" or "bf16" autocast for the backbone
+                and decode heads, defaults to the precision of the model.
+            internal_resolution (int | tuple): resolution the network runs at,
+                as a size or (height, width) divisible by 32; defaults to the
+                training resolution (320x320). Lower is faster, higher can be
+                more accurate; `python -m perspective2d.evaluation` measures the
+                trade-off. ParamNet still sees fields at the training resolution.
+            structured (bool): return a :class:`BatchPredictions` holding one
+                array per camera parameter instead of a list.
+
+        Returns:
+            list | BatchPredictions: per-image prediction dicts.
+        """
+        kwargs = {
+            "output_mode": output_mode,
+            "precision": precision,
+            "internal_resolution": internal_resolution,
+        }
+        # lazy results are cheap to produce and would be computed in full
+        if self.cache is not None and output_mode != "lazy":
+            predictions = self.cache.inference_batch(
+                self, img_bgr_list, self._inference_batch, **kwargs
+            )
+            if structured:
+                return BatchPredictions.from_list(predictions)
+            return predictions
+        return self._inference_batch(img_bgr_list, structured=structured, **kwargs)
+
+    def _inference_batch(
+        self,
+        img_bgr_list,
+        output_mode,
+        precision,
+        internal_resolution,
+        structured=False,
+    ):
+        images, batched_inputs = self.preprocess_batch(
+            img_bgr_list, internal_resolution=internal_resolution
+        )
+        return self._forward_images(
+            images,
+            batched_inputs,
+            output_mode=output_mode,
+            precision=precision,
+            structured=structured,
+        )
 
     @torch.no_grad()
-    def inference_batch(self, img_bgr_list):
-        input_list = []
-        for img_bgr in img_bgr_list:
-            original_image = img_bgr.copy()
-            if self.input_format == "RGB":
-                # whether the model expects BGR inputs or RGB
-                original_image = original_image[:, :, ::-1]
-            height, width = original_image.shape[:2]
-            image = self.aug.apply_image(original_image)
-            image = torch.as_tensor(image.astype("float32").transpose(2, 0, 1))
-            inputs = {"image": image, "height": height, "width": width}
-            input_list.append(inputs)
-        predictions = self.forward(input_list)
-        return predictions
-
-    def forward(self, batched_inputs) -> dict:
+    def inference_params(
+        self, img_bgr_list, precision=None, internal_resolution=None, numpy=True
+    ):
+        """
+        Camera parameters of a batch of images as one array per parameter.
+
+        Only the network-resolution fields feeding ParamNet are computed; nothing
+        is upsampled to the original image size and no per-image dicts are built.
+
+        Args:
+            img_bgr_list (list | np.ndarray | torch.Tensor): HxWx3 BGR uint8
+                images, see :meth:`preprocess_batch`.
+            precision (str): see :meth:`inference_batch`.
+            internal_resolution (int | tuple): see :meth:`inference_batch`.
+            numpy (bool): return float32 NumPy arrays (one device transfer for the
+                whole batch) instead of tensors on the model device.
+
+        Returns:
+            dict: "pred_roll", "pred_pitch", "pred_general_vfov", ... of shape (N,).
+        """
+        if self.param_net is None:
+            raise ValueError(f"{self.version} has no ParamNet")
+        if self.cache is not None:
+            predictions = self.inference_batch(
+                img_bgr_list,
+                output_mode="params",
+                precision=precision,
+                internal_resolution=internal_resolution,
+            )
+            param = {
+                k: torch.stack([p[k] for p in predictions]).to(self.device)
+                for k in predictions[0]
+            }
+        else:
+            images, batched_inputs = self.preprocess_batch(
+                img_bgr_list, internal_resolution=internal_resolution
+            )
+            results, raw_params = self._network(images, precision)
+            param = self._camera_params(results, raw_params, images, batched_inputs)
+        if not numpy:
+            return param
+        keys = list(param)
+        stacked = torch.stack([param[k].float() for k in keys]).cpu().numpy()
+        return dict(zip(keys, stacked))
+
+    def stream(
+        self,
+        source,
+        batch_size=8,
+        num_workers=4,
+        prefetch=2,
+        output_mode="full",
+        precision=None,
+        internal_resolution=None,
+    ):
+        """
+        Generator API over image files, directories, videos or in-memory frames.
+
+        Decoding and preprocessing run on background threads while the model
+        processes full micro-batches; results are yielded in source order and at
+        most `prefetch` batches are held in memory ahead of the model.
+
+        Args:
+            source: a video file, an image directory, or an iterable of image
+                paths and/or HxWx3 BGR uint8 frames.
+            batch_size (int): number of images per forward pass.
+            num_workers (int): number of decoding threads.
+            prefetch (int): number of batches prepared ahead of the model.
+            output_mode (str): see :meth:`inference_batch`.
+            precision (str): see :meth:`inference_batch`.
+            internal_resolution (int | tuple): see :meth:`inference_batch`.
+
+        Yields:
+            tuple: (key, prediction) where key is the image path, the
+                "<video>:<frame index>" or the position in the iterable.
+        """
+        from .streaming import stream
+
+        return stream(
+            self,
+            source,
+            batch_size=batch_size,
+            num_workers=num_workers,
+            prefetch=prefetch,
+            output_mode=output_mode,
+            precision=precision,
+            internal_resolution=internal_resolution,
+        )
+
+    def forward(self, batched_inputs, output_mode="full", precision=None) -> dict:
         """
         Forward pass of the PerspectiveFields model.
 
         Args:
             batched_inputs (list): A list of dictionaries containing the input data.
+            output_mode (str): see :meth:`inference_batch`.
+            precision (str): see :meth:`inference_batch`.
 
         Returns:
             dict: A dictionary containing the computed losses or processed results.
@@ -234,14 +688,44 @@ class PerspectiveFields(nn.Module):
         images = [x["image"].to(self.device) for x in batched_inputs]
         images = [(x - self.pixel_mean) / self.pixel_std for x in images]
         images = torch.stack(images)
-        hl_features = self.backbone(images)
-        ll_features = self.ll_enc(images)
-        features = {
-            "hl": hl_features,  # features from backbone
-            "ll": ll_features,  # low level features
-        }
+        return self._forward_images(
+            images, batched_inputs, output_mode=output_mode, precision=precision
+        )
+
+    def _forward_images(
+        self,
+        images,
+        batched_inputs,
+        output_mode="full",
+        precision=None,
+        hl_features=None,
+        ll_features=None,
+        structured=False,
+    ):
+        """
+        Run the network on already normalized images.
+
+        Args:
+            images (torch.Tensor): normalized images of shape (N, 3, H, W).
+            batched_inputs (list): per-image dicts holding at least the original
+                "height" and "width".
+            output_mode (str): see :meth:`inference_batch`.
+            precision (str): see :meth:`inference_batch`.
+            hl_features (list): backbone features to use instead of running the
+                backbone on `images`, e.g. those of a previous video frame.
+            ll_features (torch.Tensor): low-level encoder features to use
+                instead of running the encoder on `images`.
+            structured (bool): see :meth:`inference_batch`.
+
+        Returns:
+            list | BatchPredictions: per-image prediction dicts.
+        """
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode: {output_mode}")
+        results, raw_params = self._network(images, precision, hl_features, ll_features)
 
         targets_dict = {}
+
         if "gt_gravity" in batched_inputs[0]:
             targets = [x["gt_gravity"].to(self.device) for x in batched_inputs]
             targets = torch.stack(targets)
@@ -252,21 +736,130 @@ class PerspectiveFields(nn.Module):
             targets = torch.stack(targets)
             targets_dict["gt_latitude"] = targets
 
-        results = self.persformer_heads.inference(features)
-        processed_results = self.persformer_heads.postprocess(
-            results, batched_inputs, images
-        )
+        if output_mode == "full":
+            processed_results = self.persformer_heads.postprocess(
+                results, batched_inputs, images
+            )
+        elif output_mode == "lazy":
+            processed_results = self.persformer_heads.postprocess(
+                results, batched_inputs, images, lazy=True
+            )
+        elif output_mode == "network":
+            processed_results = [
+                {k: v[i] for k, v in results.items()}
+                for i in range(len(batched_inputs))
+            ]
+        else:
+            processed_results = [{} for _ in batched_inputs]
+        padded = "image_size" in batched_inputs[0]
+        if padded:
+            # crop the padding out of the network-resolution fields
+            for result, input_per_image in zip(processed_results, batched_inputs):
+                h, w = input_per_image["image_size"]
+                for key in ("pred_gravity", "pred_latitude"):
+                    if key in result:
+                        result[key] = result[key][:, :h, :w]
 
         if self.param_net is not None:
-            param = self.param_net(results, batched_inputs)
-            if "pred_general_vfov" not in param.keys():
-                param["pred_general_vfov"] = param["pred_vfov"]
-            if "pred_rel_cx" not in param.keys():
-                param["pred_rel_cx"] = torch.zeros_like(param["pred_vfov"])
-            if "pred_rel_cy" not in param.keys():
-                param["pred_rel_cy"] = torch.zeros_like(param["pred_vfov"])
+            param = self._camera_params(results, raw_params, images, batched_inputs)
+            if structured:
+                return BatchPredictions(param, processed_results)
             assert len(processed_results) == len(param["pred_general_vfov"])
             for i in range(len(processed_results)):
                 param_tmp = {k: v[i] for k, v in param.items()}
                 processed_results[i].update(param_tmp)
+        if structured:
+            return BatchPredictions({}, processed_results)
         return processed_results
+
+    def _network(self, images, precision=None, hl_features=None, ll_features=None):
+        """
+        Network-resolution fields of normalized images, and the raw ParamNet
+        regression if the traced core computed it (else None).
+        """
+        precision = _check_precision(precision or self.precision)
+        if self.quantize is not None and precision != "fp32":
+            raise ValueError("Quantized models only run in fp32")
+        images = images.contiguous(memory_format=self.memory_format)
+        traced = None
+        if precision == "fp32" and hl_features is None and ll_features is None:
+            traced = self._traced.get((*images.shape[-2:], self.device.type))
+        raw_params = None
+        if traced is not None:
+            gravity, latitude, raw_params = traced(images)
+            results = {"pred_gravity": gravity, "pred_latitude": latitude}
+        else:
+            with self._autocast(precision):
+                if hl_features is None:
+                    hl_features = self.backbone(images)
+                if ll_features is None:
+                    ll_features = self.ll_enc(images)
+                features = {
+                    "hl": hl_features,  # features from backbone
+                    "ll": ll_features,  # low level features
+                }
+                results = self.persformer_heads.inference(features)
+            # postprocessing (asin, normalize) and ParamNet regression stay in fp32
+            results = {k: v.float() for k, v in results.items()}
+        return results, raw_params
+
+    def _camera_params(self, results, raw_params, images, batched_inputs):
+        """
+        Batched ParamNet outputs for the network-resolution `results`.
+        """
+        training_size = (self.aug.new_h, self.aug.new_w)
+        padded = "image_size" in batched_inputs[0]
+        if padded or tuple(images.shape[-2:]) != training_size:
+            # the traced regression ran on padded or differently sized fields
+            raw_params = self.param_net.regress(
+                *self._param_net_inputs(results, batched_inputs)
+            )
+        elif raw_params is None:
+            raw_params = self.param_net.regress(
+                results["pred_gravity"], results["pred_latitude"]
+            )
+        param = self.param_net.decode(raw_params)
+        if "pred_general_vfov" not in param.keys():
+            param["pred_general_vfov"] = param["pred_vfov"]
+        if "pred_rel_cx" not in param.keys():
+            param["pred_rel_cx"] = torch.zeros_like(param["pred_vfov"])
+        if "pred_rel_cy" not in param.keys():
+            param["pred_rel_cy"] = torch.zeros_like(param["pred_vfov"])
+        return param
+
+
+def _init_hook_owner(modules, module_name):
+    """
+    The outermost module above `module_name` (or the module itself) with an
+    `_init_weights` hook, or None.
+    """
+    if not module_name:
+        # PerspectiveFields._init_weights loads the checkpoint
+        return None
+    parts = module_name.split(".")
+    for depth in range(1, len(parts) + 1):
+        owner = modules[".".join(parts[:depth])]
+        if hasattr(owner, "_init_weights"):
+            return owner
+    return None
+
+
+def _check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    return precision
+
+
+def _stack_frames(frames):
+    """
+    Stack HxWx3 uint8 frames given as NumPy arrays or torch tensors into a single
+    NxHxWx3 uint8 tensor without intermediate float copies.
+    """
+    if isinstance(frames, torch.Tensor):
+        return frames
+    if isinstance(frames, np.ndarray):
+        return torch.from_numpy(np.ascontiguousarray(frames))
+    if all(isinstance(f, torch.Tensor) for f in frames):
+        return torch.stack(frames)
+    frames = [f.cpu().numpy() if isinstance(f, torch.Tensor) else f for f in frames]
+    return torch.from_numpy(np.stack(frames))
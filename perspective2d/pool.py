@@ -0,0 +1,440 @@
+"""
+Multi-process CPU inference with shared weights.
+
+A single PerspectiveFields process rarely keeps a many-core host busy, and
+running N independent copies costs N times the memory. :class:`InferencePool`
+loads the model once, moves its weights to shared memory and hands them to
+spawned worker processes, which map the same pages instead of copying them.
+Frames reach the workers through a ring of shared-memory slots: the caller's
+image is copied once into a free slot and workers run on a view of it.
+
+    from perspective2d.pool import InferencePool
+    with InferencePool("Paramnet-360Cities-edina-centered", workers=4) as pool:
+        predictions = pool.inference_batch(img_bgr_list)
+
+`python -m perspective2d.pool --workers 4 --threads 2` compares the throughput
+of a pool against a single process on the bundled images.
+"""
+
+import argparse
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from .perspectivefields import PerspectiveFields
+
+# seconds between liveness checks of the workers while waiting for results
+_POLL_INTERVAL = 1.0
+# seconds a worker gets to exit on close before it is terminated
+_JOIN_TIMEOUT = 30.0
+
+
+def _to_numpy(prediction):
+    return {
+        k: v.cpu().numpy() if torch.is_tensor(v) else v for k, v in prediction.items()
+    }
+
+
+def _from_numpy(prediction):
+    return {
+        k: torch.from_numpy(v) if isinstance(v, np.ndarray) else v
+        for k, v in prediction.items()
+    }
+
+
+def unshared_tensors(model):
+    """
+    Names of the parameters and buffers of `model` that are not in shared
+    memory.
+    """
+    tensors = itertools.chain(model.named_parameters(), model.named_buffers())
+    return [name for name, tensor in tensors if not tensor.is_shared()]
+
+
+def _worker(model, shm_name, slot_bytes, tasks, results, threads, quantize):
+    # the start-up message is the list of unshared tensors, or the traceback
+    # of a failed start-up
+    try:
+        torch.set_num_threads(threads)
+        if quantize is not None:
+            from .quantization import quantize_dynamic
+
+            # packed int8 weights are private to each worker, the other tensors
+            # must stay in shared memory
+            quantize_dynamic(model)
+        shm = shared_memory.SharedMemory(name=shm_name)
+    except Exception:
+        results.put((None, os.getpid(), traceback.format_exc()))
+        return
+    slots = np.ndarray((shm.size // slot_bytes, slot_bytes), np.uint8, shm.buf)
+    results.put((None, os.getpid(), unshared_tensors(model)))
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            job_id, frames, kwargs = task
+            imgs = None
+            try:
+                imgs = [
+                    (
+                        slots[slot, : math.prod(shape)].reshape(shape)
+                        if slot is not None
+                        else frame
+                    )
+                    for slot, shape, frame in frames
+                ]
+                with torch.no_grad():
+                    predictions = model.inference_batch(imgs, **kwargs)
+                results.put((job_id, [_to_numpy(p) for p in predictions], None))
+            except Exception:
+                results.put((job_id, None, traceback.format_exc()))
+            finally:
+                # drop the views before the slots are reused
+                del imgs
+    finally:
+        del slots
+        shm.close()
+
+
+class InferencePool:
+    """
+    Pool of worker processes sharing one set of CPU weights.
+
+    Args:
+        version (str): a `model_zoo` key.
+        workers (int): number of worker processes, defaults to the number of
+            CPUs.
+        threads_per_worker (int): intra-op threads of each worker, defaults to
+            CPUs // workers (at least 1).
+        batch_size (int): maximum number of images handed to a worker at once.
+        slots (int): number of frames in the shared ring buffer, defaults to
+            2 * workers * batch_size. Callers block until all slots of a batch
+            are free.
+        max_frame_size (tuple): (height, width) of the largest frame a slot
+            holds; larger frames are pickled to the worker instead.
+        **kwargs: passed to `PerspectiveFields`. With `quantize="dynamic"`,
+            each worker quantizes its own copy of the Linear layers.
+    """
+
+    def __init__(
+        self,
+        version="Paramnet-360Cities-edina-centered",
+        workers=None,
+        threads_per_worker=None,
+        batch_size=4,
+        slots=None,
+        max_frame_size=(1080, 1920),
+        **kwargs,
+    ):
+        cpus = os.cpu_count() or 1
+        self.workers = workers or cpus
+        self.threads_per_worker = threads_per_worker or max(1, cpus // self.workers)
+        self.batch_size = batch_size
+        quantize = kwargs.pop("quantize", None)
+        model = PerspectiveFields(version, **kwargs).eval()
+        if model.device.type != "cpu":
+            raise ValueError("InferencePool runs on CPU")
+        model.share_memory()
+
+        self.slot_bytes = max_frame_size[0] * max_frame_size[1] * 3
+        num_slots = slots or 2 * self.workers * batch_size
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=num_slots * self.slot_bytes
+        )
+        self._slots = np.ndarray((num_slots, self.slot_bytes), np.uint8, self._shm.buf)
+        self._free = list(range(num_slots))
+        self._slots_freed = threading.Condition()
+
+        ctx = mp.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._processes = [
+            ctx.Process(
+                target=_worker,
+                args=(
+                    model,
+                    self._shm.name,
+                    self.slot_bytes,
+                    self._tasks,
+                    self._results,
+                    self.threads_per_worker,
+                    quantize,
+                ),
+                daemon=True,
+            )
+            for _ in range(self.workers)
+        ]
+        for process in self._processes:
+            process.start()
+        # the workers hold the shared weights now
+        del model
+        error = self._wait_for_workers()
+
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closed = False
+        self._broken = None
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        if error is not None:
+            self.close()
+            raise RuntimeError(error)
+
+    def _dead_worker(self):
+        for process in self._processes:
+            if process.exitcode is not None:
+                return f"Worker {process.pid} exited with code {process.exitcode}"
+        return None
+
+    def _wait_for_workers(self):
+        """
+        Wait for the start-up message of every worker.
+
+        Returns:
+            str: why the pool cannot run, or None.
+        """
+        unshared = set()
+        for _ in self._processes:
+            while True:
+                try:
+                    _, pid, status = self._results.get(timeout=_POLL_INTERVAL)
+                    break
+                except queue.Empty:
+                    # e.g. the model could not be unpickled in the worker
+                    dead = self._dead_worker()
+                    if dead is not None:
+                        return f"{dead} during start-up"
+            if isinstance(status, str):
+                return f"Worker {pid} failed to start:\n{status}"
+            unshared.update(status)
+        if unshared:
+            return (
+                f"Workers hold private copies of {len(unshared)} tensors, "
+                f"e.g. {sorted(unshared)[:5]}"
+            )
+        return None
+
+    def _collect(self):
+        while True:
+            try:
+                job_id, predictions, error = self._results.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                dead = None if self._closed else self._dead_worker()
+                if dead is not None:
+                    # its job is lost and the others may be queued behind it
+                    self._fail_pending(f"{dead}; the pool cannot be used anymore")
+                    return
+                continue
+            if job_id is None:
+                return
+            with self._lock:
+                future, used = self._jobs.pop(job_id)
+            with self._slots_freed:
+                self._free.extend(used)
+                self._slots_freed.notify_all()
+            if error is not None:
+                future.set_exception(RuntimeError(f"Worker failed:\n{error}"))
+            else:
+                future.set_result([_from_numpy(p) for p in predictions])
+
+    def _fail_pending(self, reason):
+        with self._lock:
+            self._broken = reason
+            jobs, self._jobs = self._jobs, {}
+        with self._slots_freed:
+            for _, used in jobs.values():
+                self._free.extend(used)
+            self._slots_freed.notify_all()
+        for future, _ in jobs.values():
+            if not future.done():
+                future.set_exception(RuntimeError(reason))
+
+    def submit(
+        self,
+        img_bgr_list,
+        output_mode="full",
+        precision=None,
+        internal_resolution=None,
+    ):
+        """
+        Queue a batch for one worker. Blocks until enough shared-memory slots
+        are free for all of its frames.
+
+        Raises:
+            ValueError: if the batch needs more slots than the pool has.
+            RuntimeError: if the pool is closed or a worker died.
+
+        Returns:
+            concurrent.futures.Future: resolves to the per-image prediction
+                dicts, as `PerspectiveFields.inference_batch`.
+        """
+        if self._closed:
+            raise RuntimeError("InferencePool is closed")
+        if self._broken is not None:
+            raise RuntimeError(self._broken)
+        imgs = [np.ascontiguousarray(img, dtype=np.uint8) for img in img_bgr_list]
+        needed = sum(img.nbytes <= self.slot_bytes for img in imgs)
+        if needed > len(self._slots):
+            raise ValueError(
+                f"A batch of {needed} frames does not fit in {len(self._slots)} "
+                "slots; submit smaller batches or create the pool with more slots"
+            )
+        # reserve the slots of the whole batch at once, so that concurrent
+        # callers never hold part of the ring each and wait for each other
+        with self._slots_freed:
+            self._slots_freed.wait_for(
+                lambda: self._broken is not None or len(self._free) >= needed
+            )
+            if self._broken is not None:
+                raise RuntimeError(self._broken)
+            used = self._free[:needed]
+            del self._free[:needed]
+        frames, free = [], iter(used)
+        for img in imgs:
+            if img.nbytes > self.slot_bytes:
+                frames.append((None, img.shape, img))
+                continue
+            slot = next(free)
+            self._slots[slot, : img.nbytes] = img.reshape(-1)
+            frames.append((slot, img.shape, None))
+        future = Future()
+        job_id = next(self._ids)
+        with self._lock:
+            if self._broken is not None:
+                raise RuntimeError(self._broken)
+            self._jobs[job_id] = (future, used)
+        kwargs = {
+            "output_mode": output_mode,
+            "precision": precision,
+            "internal_resolution": internal_resolution,
+        }
+        self._tasks.put((job_id, frames, kwargs))
+        return future
+
+    def inference(
+        self, img_bgr, output_mode="full", precision=None, internal_resolution=None
+    ):
+        return self.inference_batch(
+            [img_bgr],
+            output_mode=output_mode,
+            precision=precision,
+            internal_resolution=internal_resolution,
+        )[0]
+
+    def inference_batch(
+        self,
+        img_bgr_list,
+        output_mode="full",
+        precision=None,
+        internal_resolution=None,
+    ):
+        """
+        Split `img_bgr_list` across the workers and gather the predictions.
+
+        Same arguments and return value as `PerspectiveFields.inference_batch`;
+        with output_mode="lazy" the full-resolution fields are computed by the
+        workers, since they cannot be deferred across processes.
+        """
+        if not img_bgr_list:
+            return []
+        size = min(
+            self.batch_size,
+            len(self._slots),
+            math.ceil(len(img_bgr_list) / self.workers),
+        )
+        futures = [
+            self.submit(
+                img_bgr_list[i : i + size],
+                output_mode,
+                precision,
+                internal_resolution,
+            )
+            for i in range(0, len(img_bgr_list), size)
+        ]
+        return [p for future in futures for p in future.result()]
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(_JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        # tasks left by a dead worker must not block the exit of this process
+        self._tasks.close()
+        self._tasks.cancel_join_thread()
+        self._results.put((None, None, None))
+        self._collector.join()
+        del self._slots
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare InferencePool throughput with a single process"
+    )
+    parser.add_argument("--version", default="Paramnet-360Cities-edina-centered")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None, help="per worker")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--images", default=None)
+    parser.add_argument("--repeat", type=int, default=4)
+    return parser
+
+
+def main(args=None):
+    from .parity import load_images
+
+    args = get_parser().parse_args(args)
+    images = args.images or os.path.join(
+        os.path.dirname(__file__), "..", "assets", "imgs"
+    )
+    imgs = load_images(images) * args.repeat
+
+    model = PerspectiveFields(args.version).eval()
+    model.inference_batch(imgs[: args.batch_size])
+    start = time.perf_counter()
+    for i in range(0, len(imgs), args.batch_size):
+        model.inference_batch(imgs[i : i + args.batch_size])
+    single = len(imgs) / (time.perf_counter() - start)
+    del model
+
+    with InferencePool(
+        args.version, args.workers, args.threads, args.batch_size
+    ) as pool:
+        pool.inference_batch(imgs[: pool.workers])
+        start = time.perf_counter()
+        pool.inference_batch(imgs)
+        pooled = len(imgs) / (time.perf_counter() - start)
+        print(
+            f"single process: {single:.2f} img/s, "
+            f"{pool.workers} workers x {pool.threads_per_worker} threads: "
+            f"{pooled:.2f} img/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import torch
+import torch.nn as nn
+
+QUANTIZATION_MODES = (None, "dynamic")
+
+
+def quantize_dynamic(model, dtype=torch.qint8):
+    """
+    Apply int8 dynamic quantization to the `nn.Linear` layers of the backbone
+    (attention, MLP) and of the decode heads (MLP projections), in place.
+
+    Weights are quantized once, activations per call, so no calibration data
+    is needed. ParamNet is left in fp32 since its regression outputs are the
+    camera parameters themselves. Quantized layers only run on CPU.
+
+    Args:
+        model (PerspectiveFields): model with its weights loaded.
+        dtype (torch.dtype): quantized weight type.
+
+    Returns:
+        PerspectiveFields: `model`.
+    """
+    for name in ("backbone", "persformer_heads"):
+        module = torch.ao.quantization.quantize_dynamic(
+            getattr(model, name), {nn.Linear}, dtype=dtype, inplace=True
+        )
+        setattr(model, name, module)
+    model.quantize = "dynamic"
+    return model
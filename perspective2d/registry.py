@@ -0,0 +1,209 @@
+"""
+Local weight cache for the `model_zoo` checkpoints.
+
+Checkpoints are stored under `$PERSPECTIVE2D_CACHE/weights` (default
+`~/.cache/perspective2d/weights`) using the file name of their URL, so a cache
+can be pre-seeded by copying files there, or with
+
+    python -m perspective2d.registry --seed Paramnet-360Cities-edina-centered /path/to/paramnet_360cities_edina_rpf.pth
+
+With `PERSPECTIVE2D_OFFLINE=1` nothing is downloaded and a missing checkpoint is
+an error. Checksums are verified when known, either from a "sha256" entry in
+`model_zoo` or from a `SHA256SUMS` file (as written by `sha256sum`) next to the
+checkpoints.
+"""
+
+import argparse
+import hashlib
+import inspect
+import os
+import shutil
+from urllib.parse import urlparse
+
+from .model_zoo import model_zoo
+
+CHECKSUM_FILE = "SHA256SUMS"
+
+
+def default_cache_dir():
+    """
+    `$PERSPECTIVE2D_CACHE`, or `~/.cache/perspective2d` if it is not set.
+    """
+    return os.environ.get(
+        "PERSPECTIVE2D_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "perspective2d"),
+    )
+
+
+def weights_dir(cache_dir=None):
+    return os.path.join(cache_dir or default_cache_dir(), "weights")
+
+
+def is_offline():
+    value = os.environ.get("PERSPECTIVE2D_OFFLINE", "")
+    return value.lower() not in ("", "0", "false")
+
+
+def _entry(version):
+    if version not in model_zoo:
+        raise ValueError(f"Unknown model version: {version}")
+    return model_zoo[version]
+
+
+def cached_path(version, cache_dir=None):
+    """
+    Where the checkpoint of `version` lives in the cache, whether or not it exists.
+    """
+    filename = os.path.basename(urlparse(_entry(version)["weights"]).path)
+    return os.path.join(weights_dir(cache_dir), filename)
+
+
+def _torch_hub_path(path):
+    try:
+        import torch.hub
+    except ImportError:
+        return None
+    return os.path.join(torch.hub.get_dir(), "checkpoints", os.path.basename(path))
+
+
+def sha256sum(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def expected_checksum(version, cache_dir=None):
+    """
+    Known sha256 of the checkpoint of `version`, or None.
+    """
+    checksum = _entry(version).get("sha256")
+    if checksum:
+        return checksum
+    sums = os.path.join(weights_dir(cache_dir), CHECKSUM_FILE)
+    if os.path.exists(sums):
+        filename = os.path.basename(cached_path(version, cache_dir))
+        with open(sums) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1].lstrip("*") == filename:
+                    return parts[0]
+    return None
+
+
+def verify(path, checksum):
+    """
+    Raise an IOError if the sha256 of `path` does not match `checksum`.
+    """
+    actual = sha256sum(path)
+    if actual != checksum.lower():
+        raise IOError(
+            f"Checksum mismatch for {path}: expected {checksum}, got {actual}"
+        )
+
+
+def weights_path(version, cache_dir=None, offline=None, check=True):
+    """
+    Local path of the checkpoint of `version`, downloading it on a cache miss.
+
+    Args:
+        version (str): a `model_zoo` key.
+        cache_dir (str): defaults to :func:`default_cache_dir`.
+        offline (bool): never download, defaults to `$PERSPECTIVE2D_OFFLINE`.
+        check (bool): verify the checksum when it is known.
+
+    Returns:
+        str: path of the checkpoint.
+    """
+    path = cached_path(version, cache_dir)
+    offline = is_offline() if offline is None else offline
+    if not os.path.exists(path):
+        # checkpoints fetched by earlier releases through torch.hub
+        hub_path = _torch_hub_path(path)
+        if hub_path is not None and os.path.exists(hub_path):
+            path = hub_path
+    if not os.path.exists(path):
+        if offline:
+            raise FileNotFoundError(
+                f"No cached weights for {version} at {path} and downloads are "
+                "disabled; seed the cache with `python -m perspective2d.registry "
+                f"--seed {version} <checkpoint>`"
+            )
+        from torch.hub import download_url_to_file
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        download_url_to_file(_entry(version)["weights"], path)
+    checksum = expected_checksum(version, cache_dir) if check else None
+    if checksum:
+        verify(path, checksum)
+    return path
+
+
+def seed(version, source, cache_dir=None):
+    """
+    Copy a checkpoint of `version` into the cache (and check it if possible).
+    """
+    path = cached_path(version, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copyfile(source, path)
+    checksum = expected_checksum(version, cache_dir)
+    if checksum:
+        verify(path, checksum)
+    return path
+
+
+def load_checkpoint(path, mmap=True):
+    """
+    Load a state dict on CPU, unwrapping the "model" entry of training
+    checkpoints.
+
+    With `mmap`, tensors are memory-mapped from the file instead of read into
+    private memory, so processes loading the same checkpoint share its pages.
+    Checkpoints in the legacy (non-zip) format are read normally.
+    """
+    import torch
+
+    kwargs = {"map_location": "cpu"}
+    if mmap and "mmap" in inspect.signature(torch.load).parameters:
+        try:
+            state_dict = torch.load(path, mmap=True, **kwargs)
+        except RuntimeError:
+            state_dict = torch.load(path, **kwargs)
+    else:
+        state_dict = torch.load(path, **kwargs)
+    if "model" in state_dict:
+        state_dict = state_dict["model"]
+    return state_dict
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="PerspectiveFields weight cache")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--list", action="store_true", help="show cache status")
+    parser.add_argument(
+        "--download", nargs="*", metavar="VERSION", help="fetch weights (default all)"
+    )
+    parser.add_argument(
+        "--seed", nargs=2, metavar=("VERSION", "PATH"), help="copy weights in"
+    )
+    return parser
+
+
+def main(args=None):
+    args = get_parser().parse_args(args)
+    if args.seed:
+        print(seed(*args.seed, cache_dir=args.cache_dir))
+    if args.download is not None:
+        for version in args.download or model_zoo:
+            print(weights_path(version, args.cache_dir, offline=False))
+    if args.list or not (args.seed or args.download is not None):
+        for version in model_zoo:
+            path = cached_path(version, args.cache_dir)
+            status = "cached" if os.path.exists(path) else "missing"
+            checksum = expected_checksum(version, args.cache_dir) or "no checksum"
+            print(f"{version}: {status} {path} ({checksum})")
+
+
+if __name__ == "__main__":
+    main()
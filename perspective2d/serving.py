@@ -0,0 +1,317 @@
+"""
+Dynamic micro-batching front-end for PerspectiveFields.
+
+Concurrent requests are collected for up to `max_delay_ms` milliseconds or
+`max_batch_size` images, run through a single `inference_batch` call and the
+per-image predictions are handed back to each caller. A minimal HTTP/1.1 server
+(over TCP or a Unix socket) is included as a local stand-in for load tests:
+
+    python -m perspective2d.serving --version Paramnet-360Cities-edina-centered --port 8000
+    curl --data-binary @assets/imgs/cityscape.jpg http://127.0.0.1:8000/calibrate
+"""
+
+import argparse
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+import torch
+
+
+class MicroBatcher:
+    """
+    Collect concurrent `infer` calls into micro-batches for one model.
+
+    Args:
+        model (PerspectiveFields): model in eval mode.
+        max_batch_size (int): maximum number of images per forward pass.
+        max_delay_ms (float): how long the first request of a batch waits for
+            more requests before the batch is run.
+    """
+
+    def __init__(self, model, max_batch_size=16, max_delay_ms=5.0):
+        assert max_batch_size > 0
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000.0
+        self.stats = {"requests": 0, "batches": 0}
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self._batch = []
+
+    async def start(self):
+        if self._task is None:
+            # the model runs on a single thread so batches never interleave
+            self._executor = ThreadPoolExecutor(1)
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # requests of the cancelled batch and those still queued never run
+        pending = self._batch
+        self._batch = []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("stopped"))
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def infer(self, img_bgr, output_mode="full"):
+        """
+        Calibrate one BGR image, batched with concurrent calls.
+
+        Args:
+            img_bgr (np.ndarray): HxWx3 BGR uint8 image.
+            output_mode (str): see `PerspectiveFields.inference_batch`.
+
+        Returns:
+            dict: the same per-image prediction dict as `PerspectiveFields.inference`.
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((img_bgr, output_mode, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        # kept on self so that stop() fails requests taken off the queue
+        self._batch = batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        batch[:] = [item for item in batch if not item[-1].cancelled()]
+        return batch
+
+    def _infer(self, batch):
+        # one forward pass per output mode present in the batch
+        groups = {}
+        for i, (_, output_mode, _) in enumerate(batch):
+            groups.setdefault(output_mode, []).append(i)
+        predictions = [None] * len(batch)
+        with torch.no_grad():
+            for output_mode, idx in groups.items():
+                frames = [batch[i][0] for i in idx]
+                outputs = self.model.inference_batch(frames, output_mode=output_mode)
+                for i, pred in zip(idx, outputs):
+                    predictions[i] = pred
+        return predictions
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            try:
+                predictions = await loop.run_in_executor(
+                    self._executor, self._infer, batch
+                )
+            except Exception as e:
+                self._batch = []
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self._batch = []
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            for (_, _, future), pred in zip(batch, predictions):
+                if not future.done():
+                    future.set_result(pred)
+
+
+def prediction_to_json(pred, fields=False):
+    """
+    Convert a prediction dict into JSON-serializable values.
+
+    Scalars (camera parameters) are always kept. Per-pixel fields are only
+    included as nested lists when `fields` is set.
+    """
+    out = {}
+    for key, value in pred.items():
+        if isinstance(value, torch.Tensor):
+            if value.numel() == 1:
+                out[key] = value.item()
+            elif fields:
+                out[key] = value.cpu().tolist()
+        elif isinstance(value, np.ndarray):
+            if value.size == 1:
+                out[key] = value.item()
+            elif fields:
+                out[key] = value.tolist()
+        else:
+            out[key] = value
+    return out
+
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    500: "Internal Server Error",
+}
+
+
+class CalibrationServer:
+    """
+    Minimal HTTP/1.1 front-end around a :class:`MicroBatcher`.
+
+    Endpoints:
+        POST /calibrate[?fields=1]: body is an encoded image (JPEG, PNG, ...).
+        GET /health: batching statistics.
+    """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def serve(self, host="127.0.0.1", port=8000, unix_socket=None):
+        await self.batcher.start()
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self._handle, path=unix_socket)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self._dispatch(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode()
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode()
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        if method == "GET" and url.path == "/health":
+            return 200, {"status": "ok", **self.batcher.stats}
+        if method != "POST" or url.path != "/calibrate":
+            return 404, {"error": f"unknown endpoint {method} {url.path}"}
+        # decoding a large image would stall every connection of the event loop
+        img = await asyncio.get_running_loop().run_in_executor(
+            None, cv2.imdecode, np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR
+        )
+        if img is None:
+            return 400, {"error": "body is not a decodable image"}
+        fields = parse_qs(url.query).get("fields", ["0"])[0] not in ("0", "false")
+        # skip the full-resolution fields when only the parameters are returned
+        params_only = not fields and self.batcher.model.param_net is not None
+        try:
+            pred = await self.batcher.infer(img, "params" if params_only else "full")
+        except Exception as e:
+            return 500, {"error": repr(e)}
+        return 200, prediction_to_json(pred, fields=fields)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Micro-batching HTTP server for PerspectiveFields"
+    )
+    parser.add_argument("--version", default="Paramnet-360Cities-edina-centered")
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None, help="serve on a Unix socket")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-delay-ms", type=float, default=5.0)
+    parser.add_argument("--precision", default="fp32", help="fp32, fp16 or bf16")
+    parser.add_argument(
+        "--resize-mode", default="resize", help="resize, or pad to keep aspect ratio"
+    )
+    parser.add_argument(
+        "--cache-dir", default=None, help="cache results of repeated images here"
+    )
+    return parser
+
+
+def main(args=None):
+    from .perspectivefields import PerspectiveFields
+
+    args = get_parser().parse_args(args)
+    cache = None
+    if args.cache_dir is not None:
+        from .cache import ResultCache
+
+        cache = ResultCache(cache_dir=args.cache_dir)
+    model = (
+        PerspectiveFields(
+            args.version,
+            precision=args.precision,
+            resize_mode=args.resize_mode,
+            cache=cache,
+        )
+        .eval()
+        .to(args.device)
+    )
+    batcher = MicroBatcher(
+        model, max_batch_size=args.max_batch_size, max_delay_ms=args.max_delay_ms
+    )
+    server = CalibrationServer(batcher)
+    asyncio.run(
+        server.serve(host=args.host, port=args.port, unix_socket=args.unix_socket)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import torch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v")
+
+
+def iter_source(source):
+    """
+    Enumerate the items of a streaming source.
+
+    Args:
+        source: a video file, an image directory, a single image path, or an
+            iterable of image paths and/or HxWx3 BGR uint8 frames.
+
+    Yields:
+        tuple: (key, item) where key is the image path, "<video>:<frame index>"
+            or the position in the iterable, and item is a path or a frame.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = os.fspath(source)
+        if os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(source, name)
+                    yield path, path
+        elif source.lower().endswith(VIDEO_EXTENSIONS):
+            yield from iter_video(source)
+        else:
+            yield source, source
+        return
+    for idx, item in enumerate(source):
+        if isinstance(item, (str, os.PathLike)):
+            yield os.fspath(item), os.fspath(item)
+        else:
+            yield idx, item
+
+
+def iter_video(path):
+    """
+    Decode a video file frame by frame.
+
+    Yields:
+        tuple: ("<path>:<frame index>", BGR frame)
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video {path}")
+    try:
+        idx = 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            yield f"{path}:{idx}", frame
+            idx += 1
+    finally:
+        cap.release()
+
+
+def load_frame(item):
+    """
+    Return a BGR uint8 frame for a path or pass frames through unchanged.
+    """
+    if isinstance(item, str):
+        img = cv2.imread(item)
+        if img is None:
+            raise IOError(f"Cannot read image {item}")
+        return img
+    return item
+
+
+def _background(iterable, maxsize):
+    """
+    Run `iterable` in a daemon thread and yield its items through a bounded queue,
+    so directory listing and video decoding overlap with the model.
+    """
+    items = queue.Queue(maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:  # re-raised in the consumer
+            put((done, e))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is done:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream(
+    model,
+    source,
+    batch_size=8,
+    num_workers=4,
+    prefetch=2,
+    output_mode="full",
+    precision=None,
+    internal_resolution=None,
+):
+    """
+    Run `model` over a stream of images with bounded prefetching.
+
+    Images are decoded on a pool of `num_workers` threads and preprocessed on a
+    separate thread while the model runs on the previous micro-batch. At most
+    `prefetch` batches are decoded ahead of the one being inferred.
+
+    Args:
+        model (PerspectiveFields): the model to run.
+        source: see :func:`iter_source`.
+        batch_size (int): number of images per forward pass.
+        num_workers (int): number of decoding threads.
+        prefetch (int): number of batches prepared ahead of the model.
+        output_mode (str): see `PerspectiveFields.inference_batch`.
+        precision (str): see `PerspectiveFields.inference_batch`.
+        internal_resolution (int | tuple): see `PerspectiveFields.inference_batch`.
+
+    Yields:
+        tuple: (key, prediction) in source order.
+    """
+    assert batch_size > 0 and prefetch >= 0
+    decode_pool = ThreadPoolExecutor(num_workers)
+    prepare_pool = ThreadPoolExecutor(1)
+
+    def prepare(decoded):
+        keys = [key for key, _ in decoded]
+        frames = [future.result() for _, future in decoded]
+        with torch.no_grad():
+            images, batched_inputs = model.preprocess_batch(
+                frames, internal_resolution=internal_resolution
+            )
+        return keys, images, batched_inputs
+
+    def run(batch):
+        keys, images, batched_inputs = batch.result()
+        with torch.no_grad():
+            predictions = model._forward_images(
+                images, batched_inputs, output_mode=output_mode, precision=precision
+            )
+        return zip(keys, predictions)
+
+    items = _background(iter_source(source), batch_size * (prefetch + 1))
+    pending = deque()
+    try:
+        for chunk in _chunks(items, batch_size):
+            decoded = [
+                (key, decode_pool.submit(load_frame, item)) for key, item in chunk
+            ]
+            pending.append(prepare_pool.submit(prepare, decoded))
+            if len(pending) > prefetch:
+                yield from run(pending.popleft())
+        while pending:
+            yield from run(pending.popleft())
+    finally:
+        items.close()
+        for batch in pending:
+            batch.cancel()
+        prepare_pool.shutdown(wait=True)
+        decode_pool.shutdown(wait=True)
@@ -0,0 +1,152 @@
+from collections.abc import MutableMapping, Sequence
+
+import numpy as np
+
+
+class LazyDict(MutableMapping):
+    """
+    A dict whose values can be computed on first access.
+
+    Values given in `lazy` are zero-argument callables; each one is called the
+    first time its key is read and the result replaces it. Membership tests and
+    `keys()` never trigger a computation.
+
+    Args:
+        data (dict): values available immediately.
+        lazy (dict): key -> callable producing the value on first access.
+    """
+
+    def __init__(self, data=None, lazy=None):
+        self._data = dict(data or {})
+        self._lazy = {k: v for k, v in (lazy or {}).items() if k not in self._data}
+
+    def __getitem__(self, key):
+        if key in self._lazy:
+            self._data[key] = self._lazy.pop(key)()
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._lazy.pop(key, None)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        if key in self._lazy:
+            del self._lazy[key]
+        else:
+            del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data or key in self._lazy
+
+    def __iter__(self):
+        yield from self._data
+        yield from list(self._lazy)
+
+    def __len__(self):
+        return len(self._data) + len(self._lazy)
+
+    def is_computed(self, key):
+        """Whether `key` holds a value rather than a pending computation."""
+        return key in self._data
+
+    def materialize(self):
+        """Compute all pending values and return them as a plain dict."""
+        return {k: self[k] for k in list(self)}
+
+    def __repr__(self):
+        items = [f"{k!r}: {v!r}" for k, v in self._data.items()]
+        items += [f"{k!r}: <lazy>" for k in self._lazy]
+        return "LazyDict({" + ", ".join(items) + "})"
+
+
+class BatchPredictions(Sequence):
+    """
+    Predictions of a batch with one contiguous array per camera parameter.
+
+    Indexing returns the per-image prediction dict of `inference_batch`, with
+    the parameters as 0-d views into the batch arrays, so code written for the
+    list of dicts keeps working. `params`, :meth:`to_numpy`, :meth:`to_pandas`
+    and :meth:`to_arrow` read the whole batch at once instead of one `.item()`
+    (and one device sync) per scalar.
+
+    Args:
+        params (dict): parameter name -> tensor or array of shape (N,).
+        fields (list): per-image dicts of the other outputs (e.g. the fields),
+            or None if there are none.
+    """
+
+    def __init__(self, params, fields=None):
+        self.params = dict(params)
+        if fields is None:
+            size = len(next(iter(self.params.values()))) if self.params else 0
+            fields = [{} for _ in range(size)]
+        self.fields = list(fields)
+
+    @classmethod
+    def from_list(cls, predictions):
+        """
+        Build from per-image prediction dicts, stacking their 0-d entries.
+        """
+        if not predictions:
+            return cls({})
+        import torch
+
+        keys = [
+            k for k, v in predictions[0].items() if torch.is_tensor(v) and v.dim() == 0
+        ]
+        params = {k: torch.stack([p[k] for p in predictions]) for k in keys}
+        fields = []
+        for prediction in predictions:
+            for key in keys:
+                del prediction[key]
+            fields.append(prediction)
+        return cls(params, fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return BatchPredictions(
+                {k: v[idx] for k, v in self.params.items()}, self.fields[idx]
+            )
+        prediction = self.fields[idx]
+        for key, value in self.params.items():
+            prediction[key] = value[idx]
+        return prediction
+
+    def to_numpy(self):
+        """
+        Returns:
+            dict: parameter name -> float32 NumPy array of shape (N,).
+        """
+        keys = list(self.params)
+        if not keys:
+            return {}
+        values = [self.params[k] for k in keys]
+        if all(hasattr(v, "detach") for v in values):
+            import torch
+
+            # one transfer for all parameters
+            stacked = torch.stack([v.detach().float() for v in values]).cpu()
+            return dict(zip(keys, stacked.numpy()))
+        return {k: np.asarray(v, dtype=np.float32) for k, v in zip(keys, values)}
+
+    def to_pandas(self):
+        """
+        The parameters as a `pandas.DataFrame` with one row per image.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.to_numpy())
+
+    def to_arrow(self):
+        """
+        The parameters as a `pyarrow.Table` with one row per image.
+        """
+        import pyarrow as pa
+
+        return pa.table(self.to_numpy())
+
+    def __repr__(self):
+        return f"BatchPredictions(size={len(self)}, params={list(self.params)})"
@@ -1 +1,14 @@
-from .utils import *
\ No newline at end of file
+from .utils import *
+
+
+def __getattr__(name):
+    # drawing helpers pull in matplotlib, equilib and sklearn, import them on use
+    if name == "PanoCam":
+        from .panocam import PanoCam
+
+        return PanoCam
+    if name == "VisualizerPerspective":
+        from .visualizer import VisualizerPerspective
+
+        return VisualizerPerspective
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
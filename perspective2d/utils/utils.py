@@ -1,94 +1,12 @@
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.optimize
 import torch
 import torch.nn.functional as F
-from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-from .panocam import PanoCam
-from .visualizer import VisualizerPerspective
+from ..camera import general_vfov, general_vfov_to_focal
 
-
-def general_vfov(d_cx, d_cy, h, focal, degree):
-    """
-    Calculate the general vertical field of view (gvfov) given the camera intrinsic parameters.
-
-    The general vertical field of view (gvfov) is a concept employed to define the field of view (FoV) for images that may be cropped or have an off-center principal point.
-
-    The gfov is defined as follows:
-        Consider the camera's pinhole as 'O'. Let 'M1' and 'M2' represent the midpoints of the top and bottom edges of the image, respectively.
-        The gfov is defined as the angle subtended by the lines OM1 and OM2 at 'O'.
-
-    This function can handle parameters given in two ways:
-    1. Relative to the image height: In this case, h should be 1, and d_cx, d_cy, and focal should be normalized by the image height.
-    2. Absolute pixel values: In this case, h should be the image height in pixels, and d_cx, d_cy, and focal should be provided in pixels.
-
-    Args:
-        d_cx (float): Horizontal offset of the principal point (cx) from the image center.
-        d_cy (float): Vertical offset of the principal point (cy) from the image center.
-        h (float): Image height, either relative (1) or in absolute pixel values.
-        focal (float): Focal length of the camera, either relative to the image height or in absolute pixel values.
-        degree (bool): Indicator for the FoV return unit. If True, FoV is returned in degrees. If False, it's returned in radians.
-
-    Returns:
-        float: General vertical field of view (FoV), computed based on the provided parameters and returned in either degrees or radians, depending on the 'degree' parameter.
-    """
-    p_sqr = focal**2 + d_cx**2 + (d_cy + 0.5 * h) ** 2
-    q_sqr = focal**2 + d_cx**2 + (d_cy - 0.5 * h) ** 2
-    cos_FoV = (p_sqr + q_sqr - h**2) / 2 / np.sqrt(p_sqr) / np.sqrt(q_sqr)
-    FoV_rad = np.arccos(cos_FoV)
-    if degree:
-        return np.degrees(FoV_rad)
-    else:
-        return FoV_rad
-
-
-def general_vfov_to_focal(rel_cx, rel_cy, h, gvfov, degree):
-    """
-    Converts a given general vertical field of view (gvfov) to the equivalent focal length.
-
-    The general vertical field of view (gvfov) is a concept employed to define the field of view (FoV) for images that may be cropped or have an off-center principal point.
-
-    The gfov is defined as follows:
-        Consider the camera's pinhole as 'O'. Let 'M1' and 'M2' represent the midpoints of the top and bottom edges of the image, respectively.
-        The gfov is defined as the angle subtended by the lines OM1 and OM2 at 'O'.
-
-    This function accepts parameters in either relative terms or absolute pixel values:
-    1. Relative to the image height: In this case, h should be 1, and d_cx, d_cy should be normalized by the image height.
-    2. Absolute pixel values: In this case, h should be the image height in pixels, and d_cx, d_cy should be provided in pixels.
-
-    Args:
-        rel_cx (float): Horizontal offset of the principal point (cx) from the image center.
-                        It's in absolute terms if h is set to image height, else it's relative (cx coordinate / image width - 0.5).
-        rel_cy (float): Vertical offset of the principal point (cy) from the image center.
-                        It's in absolute terms if h is set to image height, else it's relative (cy coordinate / image height - 0.5).
-        h (float): Image height, either in relative terms (set as 1) or as absolute pixel values.
-        gvfov (float): General vertical field of view. It's in degrees if degree is set to True, else it's in radians.
-        degree (bool): Indicator for the gvfov unit. If True, gvfov is assumed to be in degrees. If False, it's in radians.
-
-    Returns:
-        float: Focal length, derived from the input gvfov and the principal point offsets (rel_cx, rel_cy).
-               It is relative to the image height if h is set to 1, else it's an absolute value (in pixels).
-    """
-
-    def fun(focal, *args):
-        h, d_cx, d_cy, target_cos_FoV = args
-
-        p_sqr = (focal / h) ** 2 + d_cx**2 + (d_cy + 0.5) ** 2
-        q_sqr = (focal / h) ** 2 + d_cx**2 + (d_cy - 0.5) ** 2
-        cos_FoV = (p_sqr + q_sqr - 1) / 2 / np.sqrt(p_sqr) / np.sqrt(q_sqr)
-        return cos_FoV - target_cos_FoV
-    if degree:
-        gvfov = np.radians(gvfov)
-    if type(rel_cx) != np.ndarray:
-        # if input is float
-        focal = scipy.optimize.fsolve(fun, 1.5, args=(h, rel_cx, rel_cy, np.cos(gvfov)))[0]
-    else:
-        # if input is numpy array
-        focal = scipy.optimize.fsolve(fun, np.ones(len(rel_cx)) * 1.5, args=(h, rel_cx, rel_cy, np.cos(gvfov)))
-    focal = np.abs(focal)
-    return focal
+# matplotlib (through VisualizerPerspective) and equilib/sklearn (through
+# PanoCam) are only needed for drawing and are imported on first use
 
 
 def encode_bin(vector_field, num_bin):
@@ -185,6 +103,8 @@ def draw_perspective_fields(
     Returns:
         image blended with perspective fields.
     """
+    from .visualizer import VisualizerPerspective
+
     visualizer = VisualizerPerspective(img_rgb.copy())
     vis_output = visualizer.draw_lati(latimap)
     if torch.is_tensor(up):
@@ -230,6 +150,8 @@ def draw_up_field(
     """
     if torch.is_tensor(vector_field):
         vector_field = vector_field.numpy().transpose(1, 2, 0)
+    from .visualizer import VisualizerPerspective
+
     visualizer = VisualizerPerspective(img_rgb.copy())
     im_h, im_w, _ = img_rgb.shape
     x, y = np.meshgrid(
@@ -282,6 +204,8 @@ def draw_from_r_p_f(
         np.ndarray: img with up vectors drawn on (if draw_up == True)
                     and latitude map drawn on (if draw_lat == True)
     """
+    from .panocam import PanoCam
+
     # lati_alpha is deprecated
     im_h, im_w, _ = img.shape
     if mode == "deg":
@@ -357,6 +281,8 @@ def draw_from_r_p_f_cx_cy(
                     and latitude map drawn on (if draw_lat == True)
 
     """
+    from .panocam import PanoCam
+
     im_h, im_w, _ = img.shape
     if mode == "deg":
         roll = np.radians(roll)
@@ -421,6 +347,8 @@ def draw_latitude_field(
     Returns:
         np array or VisImage depending on return_img
     """
+    from .visualizer import VisualizerPerspective
+
     visualizer = VisualizerPerspective(img_rgb.copy())
     vis_output = visualizer.draw_lati(latimap, alpha_contourf, alpha_contour)
     if return_img:
@@ -463,6 +391,9 @@ def draw_prediction_distribution(pred, gt):
     Returns:
         np.ndarray: 2D histogram
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
     fig = plt.figure()
     plt.hexbin(gt, pred)
     plt.xlabel("gt")
@@ -493,15 +424,41 @@ def pf_postprocess(result, img_size, output_height, output_width):
     Args:
         result (Tensor): semantic segmentation prediction logits. A tensor of shape (C, H, W),
             where C is the number of classes, and H, W are the height and width of the prediction.
+            A batch of shape (N, C, H, W) is processed in a single interpolation.
         img_size (tuple): image size that segmentor is taking as input.
         output_height, output_width: the desired output resolution.
 
     Returns:
         semantic segmentation prediction (Tensor): A tensor of the shape
-            (C, output_height, output_width) that contains per-pixel soft predictions.
+            (C, output_height, output_width), or (N, C, output_height, output_width) for
+            batched input, that contains per-pixel soft predictions.
     """
+    if result.dim() == 4:
+        # batched (N, C, H, W) input sharing the same output resolution
+        return F.interpolate(
+            result[:, :, : img_size[0], : img_size[1]],
+            size=(output_height, output_width),
+            mode="bilinear",
+            align_corners=False,
+        )
     result = result[:, : img_size[0], : img_size[1]].expand(1, -1, -1, -1)
     result = F.interpolate(
         result, size=(output_height, output_width), mode="bilinear", align_corners=False
     )[0]
     return result
+
+
+def group_by_size(batched_inputs):
+    """group the images of a batch by their original resolution
+
+    Args:
+        batched_inputs (list[dict]): per-image dicts holding "height" and "width"
+
+    Returns:
+        dict: (height, width) -> list of indices into batched_inputs, in order
+    """
+    groups = {}
+    for idx, input_per_image in enumerate(batched_inputs):
+        size = (input_per_image.get("height"), input_per_image.get("width"))
+        groups.setdefault(size, []).append(idx)
+    return groups
@@ -0,0 +1,301 @@
+"""
+Video calibration with temporal reuse.
+
+:class:`VideoCalibrator` runs the full model only on keyframes: every
+`keyframe_interval` frames, and whenever a cheap image-difference test detects
+a scene change. On the frames in between, the camera parameters of the
+keyframes are carried forward through an EMA or Kalman filter and, with
+`refine=True`, updated by a cheap pass that reuses the backbone features of the
+last keyframe and only runs the low-level encoder, the decode heads and
+ParamNet on the new frame:
+
+    calibrator = VideoCalibrator(pf_model, keyframe_interval=15, refine=True)
+    for key, prediction in calibrator.run("video.mp4"):
+        print(key, prediction["pred_roll"], prediction["keyframe"])
+    print(calibrator.stats())
+
+`python -m perspective2d.video video.mp4` prints the parameters per frame and
+the achieved fps and fraction of skipped full forwards.
+"""
+
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from .streaming import iter_source, load_frame
+
+FILTERS = (None, "ema", "kalman")
+
+
+class ParamFilter:
+    """
+    Per-parameter smoothing of scalar camera parameters.
+
+    Args:
+        mode (str): None (no smoothing), "ema", or "kalman" (random walk model).
+        alpha (float): EMA weight of a new measurement.
+        process_noise (float): Kalman variance added per frame, in squared
+            parameter units (degrees for angles).
+        measurement_noise (float): Kalman variance of a keyframe measurement.
+    """
+
+    def __init__(
+        self, mode="kalman", alpha=0.3, process_noise=0.05, measurement_noise=1.0
+    ):
+        if mode not in FILTERS:
+            raise ValueError(f"Unknown filter: {mode}")
+        self.mode = mode
+        self.alpha = alpha
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.state = {}
+        self.variance = {}
+
+    def predict(self):
+        """
+        Advance one frame without a measurement.
+        """
+        if self.mode == "kalman":
+            for key in self.variance:
+                self.variance[key] += self.process_noise
+        return dict(self.state)
+
+    def update(self, params, noise_scale=1.0):
+        """
+        Fold in a measurement, after :meth:`predict` for the same frame.
+
+        Args:
+            params (dict): parameter name -> float.
+            noise_scale (float): measurement noise relative to a keyframe.
+
+        Returns:
+            dict: the filtered parameters.
+        """
+        for key, value in params.items():
+            if self.mode is None or key not in self.state:
+                self.state[key] = value
+                self.variance[key] = self.measurement_noise * noise_scale
+            elif self.mode == "ema":
+                alpha = self.alpha / noise_scale
+                self.state[key] += alpha * (value - self.state[key])
+            else:
+                noise = self.measurement_noise * noise_scale
+                gain = self.variance[key] / (self.variance[key] + noise)
+                self.state[key] += gain * (value - self.state[key])
+                self.variance[key] *= 1 - gain
+        return dict(self.state)
+
+
+def _thumbnail(frame, size=32):
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA) / 255.0
+
+
+class VideoCalibrator:
+    """
+    Args:
+        model (PerspectiveFields): a model with ParamNet.
+        keyframe_interval (int): run the full model at least every that many
+            frames.
+        scene_threshold (float): mean absolute difference (in [0, 1]) between
+            32x32 grayscale thumbnails of a frame and of the last keyframe above
+            which the frame starts a new scene. A scene change forces a keyframe
+            and resets the filter.
+        filter (str): None, "ema" or "kalman", see :class:`ParamFilter`.
+        refine (bool): update the parameters on intermediate frames with a
+            heads-only pass on the backbone features of the last keyframe.
+        refine_noise (float): measurement noise of refined parameters relative
+            to keyframes.
+        output_mode (str): output mode of keyframes; intermediate frames only
+            carry camera parameters.
+        precision (str): see `PerspectiveFields.inference_batch`.
+        internal_resolution (int | tuple): see `PerspectiveFields.inference_batch`.
+        **filter_kwargs: passed to :class:`ParamFilter`.
+    """
+
+    def __init__(
+        self,
+        model,
+        keyframe_interval=10,
+        scene_threshold=0.08,
+        filter="kalman",
+        refine=False,
+        refine_noise=4.0,
+        output_mode="params",
+        precision=None,
+        internal_resolution=None,
+        **filter_kwargs,
+    ):
+        if model.param_net is None:
+            raise ValueError("VideoCalibrator needs a model with ParamNet")
+        assert keyframe_interval > 0
+        self.model = model
+        self.keyframe_interval = keyframe_interval
+        self.scene_threshold = scene_threshold
+        self.refine = refine
+        self.refine_noise = refine_noise
+        self.output_mode = output_mode
+        self.precision = precision
+        self.internal_resolution = internal_resolution
+        self.filter = ParamFilter(filter, **filter_kwargs)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the previous frames and the statistics.
+        """
+        self.filter.reset()
+        self._thumbnail = None
+        self._hl_features = None
+        self._since_keyframe = 0
+        self.frames = self.keyframes = self.scene_changes = 0
+        self.elapsed = 0.0
+
+    def _is_keyframe(self, thumbnail):
+        if self._thumbnail is None:
+            return True
+        if np.abs(thumbnail - self._thumbnail).mean() > self.scene_threshold:
+            self.scene_changes += 1
+            self.filter.reset()
+            return True
+        return self._since_keyframe >= self.keyframe_interval
+
+    @torch.no_grad()
+    def _run(self, frame, keyframe):
+        model = self.model
+        images, batched_inputs = model.preprocess_batch(
+            [frame], internal_resolution=self.internal_resolution
+        )
+        hl_features = None
+        if not keyframe:
+            hl_features = self._hl_features
+        elif self.refine:
+            with model._autocast(self.precision or model.precision):
+                hl_features = self._hl_features = model.backbone(images)
+        return model._forward_images(
+            images,
+            batched_inputs,
+            output_mode=self.output_mode if keyframe else "params",
+            precision=self.precision,
+            hl_features=hl_features,
+        )[0]
+
+    def update(self, frame):
+        """
+        Calibrate the next frame of the video.
+
+        Args:
+            frame (np.ndarray): HxWx3 BGR uint8 frame.
+
+        Returns:
+            dict: prediction with the filtered camera parameters and "keyframe",
+                whether the full model ran on this frame. Keyframes also carry
+                the outputs of `output_mode`.
+        """
+        start = time.perf_counter()
+        thumbnail = _thumbnail(frame)
+        keyframe = self._is_keyframe(thumbnail)
+        self.filter.predict()
+        if keyframe or self.refine:
+            prediction = self._run(frame, keyframe)
+            params = {k: float(v) for k, v in prediction.items() if _is_scalar(v)}
+            noise_scale = 1.0 if keyframe else self.refine_noise
+            params = self.filter.update(params, noise_scale)
+        else:
+            prediction = {}
+            params = self.filter.state
+        prediction.update({k: torch.tensor(v) for k, v in params.items()})
+        prediction["keyframe"] = keyframe
+        if keyframe:
+            self._thumbnail = thumbnail
+            self._since_keyframe = 0
+            self.keyframes += 1
+        self._since_keyframe += 1
+        self.frames += 1
+        self.elapsed += time.perf_counter() - start
+        return prediction
+
+    def run(self, source):
+        """
+        Calibrate a video file or any source accepted by
+        :func:`perspective2d.streaming.iter_source`, in order.
+
+        Yields:
+            tuple: (key, prediction), see :meth:`update`.
+        """
+        for key, item in iter_source(source):
+            yield key, self.update(load_frame(item))
+
+    def stats(self):
+        """
+        Returns:
+            dict: number of frames, keyframes and scene changes, the fraction of
+                frames that skipped the full model, and the achieved fps
+                (excluding decoding).
+        """
+        return {
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "scene_changes": self.scene_changes,
+            "skipped": 1 - self.keyframes / self.frames if self.frames else 0.0,
+            "fps": self.frames / self.elapsed if self.elapsed else 0.0,
+        }
+
+
+def _is_scalar(value):
+    return torch.is_tensor(value) and value.dim() == 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Calibrate a video")
+    parser.add_argument("source", help="video file or image directory")
+    parser.add_argument("--version", default="Paramnet-360Cities-edina-centered")
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--keyframe-interval", type=int, default=10)
+    parser.add_argument("--scene-threshold", type=float, default=0.08)
+    parser.add_argument("--filter", default="kalman", help="none, ema or kalman")
+    parser.add_argument("--refine", action="store_true")
+    parser.add_argument("--internal-resolution", type=int, default=None)
+    parser.add_argument("--json", default=None, help="write per-frame parameters")
+    return parser
+
+
+def main(args=None):
+    from .perspectivefields import PerspectiveFields
+
+    args = get_parser().parse_args(args)
+    model = PerspectiveFields(args.version).eval().to(args.device)
+    calibrator = VideoCalibrator(
+        model,
+        keyframe_interval=args.keyframe_interval,
+        scene_threshold=args.scene_threshold,
+        filter=None if args.filter == "none" else args.filter,
+        refine=args.refine,
+        internal_resolution=args.internal_resolution,
+    )
+    frames = []
+    for key, prediction in calibrator.run(args.source):
+        params = {k: float(v) for k, v in prediction.items() if _is_scalar(v)}
+        frames.append({"key": key, "keyframe": prediction["keyframe"], **params})
+        print(
+            f"{key}: roll {params['pred_roll']:.2f} pitch {params['pred_pitch']:.2f} "
+            f"vfov {params['pred_general_vfov']:.2f}"
+            + (" (keyframe)" if prediction["keyframe"] else "")
+        )
+    print(json.dumps(calibrator.stats()))
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"frames": frames, "stats": calibrator.stats()}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()